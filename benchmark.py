@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import pickle
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import constraints
+import nameranker
+import nameserver
+import profiling
+import rankcache
+
+
+TOP_K_EXPORT = 1000  # names ranked by the top_k measurement
+WORDS_PER_SOUND = 5
+SOUNDS_PER_SPELLING = 2
+TONES = ['', 'ˊ', 'ˇ', 'ˋ', '˙']
+
+# the profiling.mark_ready() marks of each tool, the last one ends the run
+STARTUP_MARKS = {
+    'pickwords': ['first_frame', 'hydrated'],
+    'picknames': ['first_frame', 'first_candidate'],
+    'picknames2': ['first_frame', 'first_candidate'],
+}
+STARTUP_TIMEOUT = 120   # seconds
+
+
+def make_fixtures(directory, num_words, num_votes, num_spelling_pairs, seed=0, rules=None):
+    # writes synthetic .pickwords.data.pkl, .picknames2.data.pkl,
+    # .picknames2.state.pkl, words-selected.pkl and names-*.txt, and
+    # names-constraints.json with rules if any
+    rng = random.Random(seed)
+    words = [chr(0x4e00 + i) for i in range(num_words)]
+
+    data = []
+    selected_spelling_sound_words_mapping = {}
+    words_per_spelling = WORDS_PER_SOUND * SOUNDS_PER_SPELLING
+    for i in range(0, num_words, words_per_spelling):
+        spelling = 's%d' % (i // words_per_spelling)
+        chewing = 'ㄅ%d' % (i // words_per_spelling)
+        spelling_words = words[i:i + words_per_spelling]
+        sound_words_pairs = []
+        for k in range(0, len(spelling_words), WORDS_PER_SOUND):
+            sound = chewing + TONES[k // WORDS_PER_SOUND % len(TONES)]
+            sound_words_pairs.append((sound, spelling_words[k:k + WORDS_PER_SOUND]))
+        data.append((spelling, chewing, sound_words_pairs))
+        selected_spelling_sound_words_mapping[spelling] = dict(sound_words_pairs)
+
+    spellings = [spelling for (spelling, chewing, sound_words_pairs) in data]
+    all_spelling_pairs = [(s1, s2) for s1 in spellings for s2 in spellings]
+    selected_spelling_pairs = rng.sample(all_spelling_pairs, min(num_spelling_pairs, len(all_spelling_pairs)))
+
+    with open(os.path.join(directory, '.pickwords.data.pkl'), 'wb') as f:
+        pickle.dump(data, f)
+    with open(os.path.join(directory, nameranker.SPELLINGS_FILE_NAME), 'wb') as f:
+        pickle.dump(spellings, f)
+    with open(os.path.join(directory, nameranker.SELECTED_WORDS_FILE_NAME), 'wb') as f:
+        pickle.dump(selected_spelling_sound_words_mapping, f)
+    nameranker.save_selected_spelling_pairs(os.path.join(directory, nameranker.SELECTED_SPELLING_PAIRS_FILE_NAME), selected_spelling_pairs)
+    if rules:
+        with open(os.path.join(directory, constraints.CONSTRAINTS_FILE_NAME), 'w', encoding='utf-8') as f:
+            json.dump(rules, f, ensure_ascii=False)
+
+    # at most half of the names are voted on, about one vote in a hundred is a ✔
+    num_votes = min(num_votes, num_words * num_words // 2)
+    names = set()
+    while len(names) < num_votes:
+        names.add((rng.choice(words), rng.choice(words)))
+    names = sorted(names)
+    rng.shuffle(names)
+    num_selected = max(1, num_votes // 100)
+    nameranker.save_names(os.path.join(directory, nameranker.SELECTED_NAMES_FILE_NAME), names[:num_selected])
+    nameranker.save_names(os.path.join(directory, nameranker.REFUSED_NAMES_FILE_NAME), names[num_selected:])
+    return num_votes
+
+
+@contextlib.contextmanager
+def fixture_copy(fixture_directory):
+    # runs in a copy of the fixtures, votes and saves of one run never
+    # reach the next
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='picknames-benchmark-')
+    try:
+        shutil.copytree(fixture_directory, directory, dirs_exist_ok=True)
+        os.chdir(directory)
+        yield directory
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+def load_picknames(backend_class, name_lengths=(2,)):
+    # what picknames.NameSelectController.load_ranker() does, minus the window
+    (ranker, selected_spelling_sound_words_mapping) = nameranker.load_ranker('picknames', backend_class, name_lengths=name_lengths)
+    return ranker
+
+
+def load_picknames2(backend_class):
+    # what picknames2.NameSelectController.load_state() does, minus the window
+    nameranker.load_spellings()
+    (ranker, selected_spelling_sound_words_mapping) = nameranker.load_ranker('picknames2', backend_class)
+    return ranker
+
+
+def save_picknames(ranker):
+    ranker.save_votes()
+
+
+def save_picknames2(ranker):
+    nameranker.save_selected_spelling_pairs(nameranker.SELECTED_SPELLING_PAIRS_FILE_NAME, ranker.name_blocks.keys())
+    ranker.save_votes()
+
+
+TOOLS = {
+    'picknames': (load_picknames, save_picknames),
+    'picknames2': (load_picknames2, save_picknames2),
+}
+
+
+def best_of(repeat, function, *args):
+    best = None
+    result = None
+    for i in range(repeat):
+        # a ranker from an earlier run may hold a process pool and shared memory
+        if hasattr(result, 'close'):
+            result.close()
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, result)
+
+
+def measure_memory(load, backend_class):
+    # bytes still allocated by a loaded and ranked ranker
+    tracemalloc.start()
+    try:
+        ranker = load(backend_class)
+        ranker.update()
+        (current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    ranker.close()
+    return current
+
+
+def load_cached(cache, backend_class, tool):
+    # what load_ranker() of picknames.py or picknames2.py does when the files have not changed
+    ranker = nameranker.NameRanker(backend_class)
+    ranker.set_loaded_state(cache.load(cache_key(tool)))
+    return ranker
+
+
+def cache_key(tool):
+    file_names = [nameranker.SELECTED_WORDS_FILE_NAME, nameranker.SELECTED_SPELLING_PAIRS_FILE_NAME, constraints.CONSTRAINTS_FILE_NAME, nameranker.SELECTED_NAMES_FILE_NAME, nameranker.REFUSED_NAMES_FILE_NAME, nameranker.VOTE_JOURNAL_FILE_NAME]
+    return rankcache.fingerprint(file_names, tool)
+
+
+def update_candidate_names_with_score(ranker):
+    ranker.update()
+    return ranker.next_candidate()
+
+
+def vote_cycle(ranker, num_votes):
+    # refuse the current candidate and fetch the next one, like a ✖ click
+    for i in range(num_votes):
+        candidate = ranker.next_candidate()
+        if candidate is None:
+            break
+        (name, score) = candidate
+        ranker.record_vote(name, False)
+        ranker.update()
+
+
+def toggle_cycle(ranker, num_toggles):
+    # switch spelling pairs off and back on, like clicks on the picknames2 grid
+    keys = list(ranker.name_blocks)[:num_toggles]
+    for key in keys:
+        ((words1, words2), num_excluded_names) = ranker.name_blocks[key]
+        ranker.remove_word_pairs(key)
+        ranker.next_candidate()
+        ranker.add_word_pairs(key, words1, words2)
+        ranker.next_candidate()
+    return max(1, 2 * len(keys))
+
+
+def run_tool(tool, backend_class, repeat, num_vote_cycles, name_lengths=(2,)):
+    (load, save) = TOOLS[tool]
+    if tool == 'picknames':
+        load = functools.partial(load, name_lengths=name_lengths)
+    results = {}
+
+    results['memory'] = measure_memory(load, backend_class)
+    (results['load_state'], ranker) = best_of(repeat, load, backend_class)
+    results['candidates'] = ranker.num_candidates()
+    cache = rankcache.RankingCache()
+    cache.save(cache_key(tool), ranker.get_loaded_state())
+    (results['load_state_cached'], cached_ranker) = best_of(repeat, load_cached, cache, backend_class, tool)
+    cached_ranker.close()
+    (results['update_candidate_names_with_score'], candidate) = best_of(repeat, update_candidate_names_with_score, ranker)
+    (results['top_k'], result) = best_of(repeat, ranker.top_k, TOP_K_EXPORT)
+    (elapsed, result) = best_of(1, vote_cycle, ranker, num_vote_cycles)
+    results['vote_cycle'] = elapsed / num_vote_cycles
+    if tool == 'picknames2':
+        (elapsed, num_toggles) = best_of(1, toggle_cycle, ranker, num_vote_cycles)
+        results['toggle_spelling_pair'] = elapsed / num_toggles
+    (results['save_state'], result) = best_of(repeat, save, ranker)
+    ranker.close()
+    return results
+
+
+def run_startup(tool):
+    # seconds from starting the tool to each of its marks, None for the
+    # marks it did not get to, as when Tk has no display
+    source_directory = os.path.dirname(os.path.abspath(__file__))
+    options_file_name = '.%s.tkinter.options' % tool
+    if not os.path.exists(options_file_name):
+        shutil.copy(os.path.join(source_directory, options_file_name), options_file_name)
+
+    marks = STARTUP_MARKS[tool]
+    results = {'startup_' + mark: None for mark in marks}
+    env = dict(os.environ, **{profiling.READY_ENV: marks[-1]})
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(source_directory, tool + '.py')], env=env,
+                               stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in process.stdout:
+            fields = line.split()
+            if len(fields) == 2 and fields[0] == 'ready' and fields[1] in marks:
+                results['startup_' + fields[1]] = time.perf_counter() - start
+        process.wait(STARTUP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    return results
+
+
+def run_server(backend_class, num_reviewers, num_votes):
+    # num_reviewers voting at once through nameserver.py on localhost
+    (ranker, selected_spelling_sound_words_mapping) = nameranker.load_ranker('picknames', backend_class)
+    ranker.update()
+    latencies = []
+
+    async def review_all():
+        server = nameserver.VotingServer(ranker)
+        await server.start('127.0.0.1', 0)
+        port = server.server.sockets[0].getsockname()[1]
+        start = time.perf_counter()
+        await asyncio.gather(*[nameserver.review('127.0.0.1', port, 'reviewer%d' % i, num_votes, latencies) for i in range(num_reviewers)])
+        elapsed = time.perf_counter() - start
+        await server.stop()
+        return (elapsed, server.num_updates)
+
+    (elapsed, num_updates) = asyncio.run(review_all())
+    ranker.close()
+
+    latencies.sort()
+    return {
+        'reviewers': num_reviewers,
+        'server_votes_per_second': len(latencies) / elapsed,
+        'server_updates': num_updates,
+        'server_vote_latency': sum(latencies) / max(1, len(latencies)),
+        'server_vote_latency_p99': latencies[int(len(latencies) * 0.99)] if latencies else None,
+    }
+
+
+def git_revision():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL)
+        return output.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time loading, ranking, voting and saving on synthetic data.')
+    parser.add_argument('--words', type=int, nargs='+', default=[50, 500, 5000], help='numbers of selected words')
+    parser.add_argument('--votes', type=int, nargs='+', default=[10000, 100000], help='numbers of prior votes')
+    parser.add_argument('--spelling-pairs', type=int, default=100, help='number of selected spelling pairs for picknames2')
+    parser.add_argument('--tools', nargs='+', choices=sorted(TOOLS), default=sorted(TOOLS))
+    parser.add_argument('--lengths', type=int, nargs='+', choices=range(1, nameranker.MAX_NAME_LENGTH + 1), default=[2], help='numbers of words of the names picknames offers')
+    parser.add_argument('--constraints', metavar='CONSTRAINTS_FILE', help='load the names with the rules of this ' + constraints.CONSTRAINTS_FILE_NAME)
+    parser.add_argument('--numpy', action='store_true', help='use the NumPy backend')
+    parser.add_argument('--processes', type=int, nargs='*', default=[], help='also run the process pool backend with these numbers of processes')
+    parser.add_argument('--repeat', type=int, default=3, help='report the best of this many runs')
+    parser.add_argument('--vote-cycles', type=int, default=20, help='votes timed per vote cycle measurement')
+    parser.add_argument('--startup', nargs='*', choices=sorted(STARTUP_MARKS), default=[], help='also time how long these tools take to show their window and first names')
+    parser.add_argument('--reviewers', type=int, nargs='*', default=[], help='numbers of reviewers voting at once through nameserver.py')
+    parser.add_argument('--output', help='append JSON lines here instead of printing them')
+    args = parser.parse_args()
+
+    rules = None
+    if args.constraints:
+        try:
+            rules = constraints.load_constraints(args.constraints)
+        except constraints.ConstraintsError as e:
+            parser.error(str(e))
+
+    backend_class = nameranker.PythonBackend
+    if args.numpy:
+        if not nameranker.import_numpy():
+            parser.error('numpy is not installed')
+        backend_class = nameranker.NumpyBackend
+    if args.processes and not nameranker.import_numpy():
+        parser.error('numpy is not installed')
+
+    # (backend class, number of processes)
+    backends = [(backend_class, None)]
+    for num_processes in args.processes:
+        backends.append((functools.partial(nameranker.ProcessPoolBackend, max_workers=num_processes), num_processes))
+
+    environment = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+    output = sys.stdout
+    if args.output:
+        output = open(args.output, 'a', encoding='utf-8')
+
+    for num_words in args.words:
+        for num_votes in args.votes:
+            fixture_directory = tempfile.mkdtemp(prefix='picknames-benchmark-')
+            try:
+                num_fixture_votes = make_fixtures(fixture_directory, num_words, num_votes, args.spelling_pairs, rules=rules)
+                for (backend, num_processes) in backends:
+                    backend_name = getattr(backend, '__name__', None) or backend.func.__name__
+                    for tool in args.tools:
+                        with fixture_copy(fixture_directory):
+                            results = run_tool(tool, backend, args.repeat, args.vote_cycles, args.lengths)
+                        record = dict(environment, backend=backend_name, processes=num_processes, tool=tool, words=num_words, votes=num_fixture_votes)
+                        if tool == 'picknames':
+                            record['lengths'] = args.lengths
+                        if rules:
+                            record['constraints'] = rules
+                        record.update(results)
+                        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                        output.flush()
+                for tool in args.startup:
+                    record = dict(environment, tool=tool, words=num_words, votes=num_fixture_votes)
+                    with fixture_copy(fixture_directory):
+                        record.update(run_startup(tool))
+                    output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    output.flush()
+                for num_reviewers in args.reviewers:
+                    record = dict(environment, backend=backend_class.__name__, tool='nameserver', words=num_words, votes=num_fixture_votes)
+                    with fixture_copy(fixture_directory):
+                        record.update(run_server(backend_class, num_reviewers, args.vote_cycles))
+                    output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    output.flush()
+            finally:
+                shutil.rmtree(fixture_directory)
+
+    if output is not sys.stdout:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+
+import nameranker
+
+
+# Rules for names never worth a vote, read from names-constraints.json:
+#
+#   {
+#     "exclude_words": "死病",          never in a name
+#     "exclude_same_word": true,        no 美美
+#     "exclude_same_sound": true,       no two words of the same sound, tone included
+#     "exclude_same_tone": true,        no two words of the same tone
+#     "exclude_tones": ["33", "4*"]     tone patterns of (w1, w2), * is any tone
+#   }
+#
+# A word's sound and tone are those of the first sound it is selected
+# under.  The rules are compiled into a NameSet over the ranker's
+# vocabulary, one row of bits at a time from per-word attribute arrays, and
+# NameRanker.filter_names() takes the names out before anything is scored.
+# The sound and tone rules are about pairs; exclude_words and
+# exclude_same_word also go in the NameSet as they are, for names of one
+# or three words.
+
+CONSTRAINTS_FILE_NAME = 'names-constraints.json'
+
+# 1 has no mark
+TONE_MARKS = {
+    'ˊ': 2,
+    'ˇ': 3,
+    'ˋ': 4,
+    '˙': 5,
+}
+
+RULES = ('exclude_words', 'exclude_same_word', 'exclude_same_sound', 'exclude_same_tone', 'exclude_tones')
+
+
+class ConstraintsError(Exception):
+    pass
+
+
+def load_constraints(file_name=CONSTRAINTS_FILE_NAME):
+    # {rule: value}, no rules without the file
+    constraints = {}
+    if os.path.exists(file_name):
+        with open(file_name, 'r', encoding='utf-8') as f:
+            try:
+                constraints = json.load(f)
+            except ValueError as e:
+                raise ConstraintsError('%s: %s' % (file_name, e))
+        check_constraints(constraints, file_name)
+    return constraints
+
+
+def check_constraints(constraints, file_name=CONSTRAINTS_FILE_NAME):
+    if not isinstance(constraints, dict):
+        raise ConstraintsError('%s: expected an object' % file_name)
+    for rule in constraints:
+        if rule not in RULES:
+            raise ConstraintsError('%s: unknown rule %r' % (file_name, rule))
+    for pattern in constraints.get('exclude_tones', []):
+        if len(pattern) != 2 or any(c not in '12345*' for c in pattern):
+            raise ConstraintsError('%s: bad tone pattern %r' % (file_name, pattern))
+
+
+def sound_tone(sound):
+    for mark, tone in TONE_MARKS.items():
+        if mark in sound:
+            return tone
+    return 1
+
+
+def word_sounds(selected_spelling_sound_words_mapping):
+    # {word: sound}, the first sound a word is selected under
+    sounds = {}
+    for spelling in sorted(selected_spelling_sound_words_mapping):
+        for sound, words in selected_spelling_sound_words_mapping[spelling].items():
+            for word in words:
+                sounds.setdefault(word, sound)
+    return sounds
+
+
+def compile_constraints(constraints, selected_spelling_sound_words_mapping, word_ids):
+    # the NameSet of the names over word_ids the rules exclude
+    names = nameranker.NameSet(word_ids)
+    if not any(constraints.get(rule) for rule in RULES):
+        return names
+    names.excluded_words.update(constraints.get('exclude_words', ''))
+    names.exclude_same_word = bool(constraints.get('exclude_same_word'))
+
+    # attributes by word id, and the columns having each of them as an int
+    # with bit j for word id j
+    sounds = word_sounds(selected_spelling_sound_words_mapping)
+    n = len(names.words)
+    word_sound_ids = [0] * n
+    word_tones = [0] * n
+    sound_ids = {}
+    sound_columns = {}
+    tone_columns = {tone: 0 for tone in range(1, 6)}
+    for i, word in enumerate(names.words):
+        sound = sounds.get(word)
+        if sound is None:
+            # no attributes, matches no sound or tone rule
+            word_sound_ids[i] = -1
+            continue
+        sound_id = sound_ids.setdefault(sound, len(sound_ids))
+        word_sound_ids[i] = sound_id
+        sound_columns[sound_id] = sound_columns.get(sound_id, 0) | 1 << i
+        word_tones[i] = sound_tone(sound)
+        tone_columns[word_tones[i]] |= 1 << i
+
+    all_columns = (1 << n) - 1
+    tone_columns['*'] = all_columns
+    excluded_columns = 0
+    for word in constraints.get('exclude_words', ''):
+        if word in word_ids:
+            excluded_columns |= 1 << word_ids[word]
+
+    tone_patterns = {}  # tone of w1: columns of w2
+    for pattern in constraints.get('exclude_tones', []):
+        (tone1, tone2) = (c if c == '*' else int(c) for c in pattern)
+        tone_patterns[tone1] = tone_patterns.get(tone1, 0) | tone_columns[tone2]
+    any_tone_columns = tone_patterns.pop('*', 0)
+
+    for i in range(n):
+        if excluded_columns >> i & 1:
+            names.add_row(i, all_columns)
+            continue
+        columns = excluded_columns | any_tone_columns
+        if constraints.get('exclude_same_word'):
+            columns |= 1 << i
+        if word_sound_ids[i] >= 0:
+            if constraints.get('exclude_same_sound'):
+                columns |= sound_columns[word_sound_ids[i]]
+            if constraints.get('exclude_same_tone'):
+                columns |= tone_columns[word_tones[i]]
+            columns |= tone_patterns.get(word_tones[i], 0)
+        if columns:
+            names.add_row(i, columns)
+    return names
+
+
+def load_filter(selected_spelling_sound_words_mapping, word_ids, file_name=CONSTRAINTS_FILE_NAME):
+    return compile_constraints(load_constraints(file_name), selected_spelling_sound_words_mapping, word_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count the names the constraints take out of the selected words.')
+    parser.add_argument('constraints_file', nargs='?', default=CONSTRAINTS_FILE_NAME)
+    args = parser.parse_args()
+
+    selected_spelling_sound_words_mapping = nameranker.load_selected_words()
+    candidate_words = set()
+    for spelling in selected_spelling_sound_words_mapping:
+        candidate_words.update(nameranker.spelling_words(selected_spelling_sound_words_mapping, spelling))
+    word_ids = {w: i for i, w in enumerate(sorted(candidate_words))}
+
+    names = load_filter(selected_spelling_sound_words_mapping, word_ids, args.constraints_file)
+    print('%d of %d names excluded' % (len(names), len(word_ids) ** 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+
+import nameranker
+import statestore
+
+
+# Writes the ranked candidate names of picknames.py or picknames2.py,
+# best first, without opening a window.  The names are streamed from the
+# ranking one at a time, so the first lines come out at once and memory
+# stays proportional to the number of words, not of names.
+
+FIELDS = ['name', 'score', 'spelling', 'sounds']
+
+
+def load_word_sounds(selected_spelling_sound_words_mapping):
+    # {(spelling, word): sound} and {word: (spelling, sound)}, the first
+    # spelling a word appears under
+    spelling_word_sounds = {}
+    word_spelling_sounds = {}
+    for spelling, selected_sound_words_mapping in selected_spelling_sound_words_mapping.items():
+        for sound, words in selected_sound_words_mapping.items():
+            for word in words:
+                spelling_word_sounds[(spelling, word)] = sound
+                word_spelling_sounds.setdefault(word, (spelling, sound))
+    return (spelling_word_sounds, word_spelling_sounds)
+
+
+def iter_rows(ranked_names, selected_spelling_sound_words_mapping):
+    # (name, score, key) to {'name', 'score', 'spelling', 'sounds'}
+    (spelling_word_sounds, word_spelling_sounds) = load_word_sounds(selected_spelling_sound_words_mapping)
+    for (name, score, key) in ranked_names:
+        if isinstance(key, tuple):
+            # a spelling pair of picknames2.py
+            spellings = key
+            sounds = [spelling_word_sounds[(spelling, w)] for (spelling, w) in zip(spellings, name)]
+        else:
+            (spellings, sounds) = zip(*[word_spelling_sounds[w] for w in name])
+        yield {
+            'name': ''.join(name),
+            'score': score,
+            'spelling': '-'.join([spelling.capitalize() for spelling in spellings]),
+            'sounds': ' '.join(sounds),
+        }
+
+
+def write_csv(f, rows):
+    writer = csv.DictWriter(f, FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_jsonl(f, rows):
+    for row in rows:
+        f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the ranked candidate names, best first.')
+    parser.add_argument('--tool', choices=['picknames', 'picknames2'], default='picknames', help='rank the names the way this tool does')
+    parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+    parser.add_argument('--limit', type=int, help='stop after this many names')
+    parser.add_argument('--output', help='write here instead of to stdout')
+    parser.add_argument('--db', help='read the selected words, spelling pairs and votes from this state database')
+    parser.add_argument('--lengths', type=int, nargs='+', choices=range(1, nameranker.MAX_NAME_LENGTH + 1), default=[2], help='numbers of words of the names, for --tool picknames')
+    args = parser.parse_args()
+
+    store = None
+    if args.db:
+        store = statestore.StateStore(args.db)
+
+    (ranker, selected_spelling_sound_words_mapping) = nameranker.load_ranker(args.tool, store=store, name_lengths=args.lengths, read_only=True)
+    ranker.update()
+    ranked_names = itertools.islice(ranker.iter_candidate_names_with_key(), args.limit)
+    rows = iter_rows(ranked_names, selected_spelling_sound_words_mapping)
+
+    f = sys.stdout
+    if args.output:
+        f = open(args.output, 'w', encoding='utf-8', newline='')
+    try:
+        WRITERS[args.format](f, rows)
+    except BrokenPipeError:
+        # the reader went away, as with | head
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        ranker.close()
+        if store:
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
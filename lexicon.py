@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import mmap
+import os
+import pickle
+import struct
+
+
+# A compiled, memory-mapped form of .pickwords.data.pkl:
+#
+#   [
+#     ("pa", "ㄅㄚ", [
+#                 ("ㄅㄚ", ["八", "捌", ...]),
+#                 ...
+#             ]
+#     ),
+#     ...
+#   ]
+#
+# Layout, all integers little-endian uint32:
+#
+#   header      magic, version, number of spellings, sounds and words, and
+#               the offsets of the tables below
+#   spellings   (spelling, chewing, first sound, number of sounds) each
+#   sounds      (sound, first word, number of words) each
+#   words       (word) each
+#   index       spelling numbers sorted by spelling, for lookups
+#   strings     UTF-8 string table, strings above are (offset, length) in it
+#
+# Nothing is decoded until it is asked for, so opening the file costs the
+# same whatever the size of the lexicon.
+
+LEXICON_FILE_NAME = '.pickwords.lexicon'
+DATA_FILE_NAME = '.pickwords.data.pkl'
+
+MAGIC = b'PWLX'
+VERSION = 1
+
+HEADER = struct.Struct('<4sIIIIIIIII')
+SPELLING = struct.Struct('<IIIIII')
+SOUND = struct.Struct('<IIII')
+WORD = struct.Struct('<II')
+INDEX = struct.Struct('<I')
+
+
+class LexiconError(Exception):
+    pass
+
+
+def compile_lexicon(data, file_name=LEXICON_FILE_NAME):
+    strings = bytearray()
+    string_refs = {}
+
+    def string_ref(s):
+        if s not in string_refs:
+            encoded = s.encode('utf-8')
+            string_refs[s] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return string_refs[s]
+
+    spellings = bytearray()
+    sounds = bytearray()
+    words = bytearray()
+    num_sounds = 0
+    num_words = 0
+    for (spelling, chewing, sound_words_pairs) in data:
+        spellings.extend(SPELLING.pack(*(string_ref(spelling) + string_ref(chewing) + (num_sounds, len(sound_words_pairs)))))
+        for (sound, sound_words) in sound_words_pairs:
+            sounds.extend(SOUND.pack(*(string_ref(sound) + (num_words, len(sound_words)))))
+            for word in sound_words:
+                words.extend(WORD.pack(*string_ref(word)))
+            num_words += len(sound_words)
+        num_sounds += len(sound_words_pairs)
+
+    order = sorted(range(len(data)), key=lambda i: data[i][0].encode('utf-8'))
+    index = b''.join(INDEX.pack(i) for i in order)
+
+    spellings_offset = HEADER.size
+    sounds_offset = spellings_offset + len(spellings)
+    words_offset = sounds_offset + len(sounds)
+    index_offset = words_offset + len(words)
+    strings_offset = index_offset + len(index)
+
+    temp_file_name = file_name + '.tmp'
+    with open(temp_file_name, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(data), num_sounds, num_words, spellings_offset, sounds_offset, words_offset, index_offset, strings_offset))
+        f.write(spellings)
+        f.write(sounds)
+        f.write(words)
+        f.write(index)
+        f.write(strings)
+    os.replace(temp_file_name, file_name)
+
+
+def convert(data_file_name=DATA_FILE_NAME, lexicon_file_name=LEXICON_FILE_NAME):
+    with open(data_file_name, 'rb') as f:
+        data = pickle.load(f)
+    compile_lexicon(data, lexicon_file_name)
+
+
+class SoundWordsPairs(object):
+
+    # the [(sound, [words])] of one spelling, decoded on iteration
+
+    def __init__(self, lexicon, first_sound, num_sounds):
+        self.lexicon = lexicon
+        self.first_sound = first_sound
+        self.num_sounds = num_sounds
+
+
+    def __len__(self):
+        return self.num_sounds
+
+
+    def __iter__(self):
+        for i in range(self.first_sound, self.first_sound + self.num_sounds):
+            yield self.lexicon.sound(i)
+
+
+class Lexicon(object):
+
+    def __init__(self, file_name=LEXICON_FILE_NAME):
+        with open(file_name, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < HEADER.size:
+            raise LexiconError('%s: truncated' % file_name)
+        (magic, version, self.num_spellings, self.num_sounds, self.num_words,
+         self.spellings_offset, self.sounds_offset, self.words_offset,
+         self.index_offset, self.strings_offset) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise LexiconError('%s: not a lexicon' % file_name)
+        if version != VERSION:
+            raise LexiconError('%s: version %d, expected %d' % (file_name, version, VERSION))
+
+
+    def string(self, offset, length):
+        start = self.strings_offset + offset
+        return self.mm[start:start + length].decode('utf-8')
+
+
+    def __len__(self):
+        return self.num_spellings
+
+
+    def __getitem__(self, i):
+        # (spelling, chewing, sound_words_pairs), like an item of .pickwords.data.pkl
+        if i < 0:
+            i += self.num_spellings
+        if not 0 <= i < self.num_spellings:
+            raise IndexError(i)
+
+        (spelling_offset, spelling_length, chewing_offset, chewing_length, first_sound, num_sounds) = SPELLING.unpack_from(self.mm, self.spellings_offset + i * SPELLING.size)
+        spelling = self.string(spelling_offset, spelling_length)
+        chewing = self.string(chewing_offset, chewing_length)
+        return (spelling, chewing, SoundWordsPairs(self, first_sound, num_sounds))
+
+
+    def spelling(self, i):
+        (spelling_offset, spelling_length) = SPELLING.unpack_from(self.mm, self.spellings_offset + i * SPELLING.size)[:2]
+        return self.string(spelling_offset, spelling_length)
+
+
+    def sound(self, i):
+        # (sound, [words])
+        (sound_offset, sound_length, first_word, num_words) = SOUND.unpack_from(self.mm, self.sounds_offset + i * SOUND.size)
+        words = []
+        for k in range(first_word, first_word + num_words):
+            words.append(self.string(*WORD.unpack_from(self.mm, self.words_offset + k * WORD.size)))
+        return (self.string(sound_offset, sound_length), words)
+
+
+    def find(self, spelling):
+        # the index of the first entry for spelling, or None
+        keys = IndexedSpellings(self)
+        encoded = spelling.encode('utf-8')
+        k = bisect.bisect_left(keys, encoded)
+        if k < len(keys) and keys[k] == encoded:
+            return INDEX.unpack_from(self.mm, self.index_offset + k * INDEX.size)[0]
+        return None
+
+
+    def spellings(self):
+        for i in range(self.num_spellings):
+            yield self.spelling(i)
+
+
+    def close(self):
+        self.mm.close()
+
+
+class IndexedSpellings(object):
+
+    # the encoded spellings in index order, for bisect
+
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+
+
+    def __len__(self):
+        return self.lexicon.num_spellings
+
+
+    def __getitem__(self, k):
+        lexicon = self.lexicon
+        i = INDEX.unpack_from(lexicon.mm, lexicon.index_offset + k * INDEX.size)[0]
+        (spelling_offset, spelling_length) = SPELLING.unpack_from(lexicon.mm, lexicon.spellings_offset + i * SPELLING.size)[:2]
+        start = lexicon.strings_offset + spelling_offset
+        return lexicon.mm[start:start + spelling_length]
+
+
+def load_lexicon(lexicon_file_name=LEXICON_FILE_NAME, data_file_name=DATA_FILE_NAME):
+    # the compiled lexicon if there is one, else the pickle
+    if os.path.exists(lexicon_file_name):
+        return Lexicon(lexicon_file_name)
+
+    with open(data_file_name, 'rb') as f:
+        return pickle.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile .pickwords.data.pkl into a memory-mapped lexicon.')
+    parser.add_argument('data_file', nargs='?', default=DATA_FILE_NAME)
+    parser.add_argument('lexicon_file', nargs='?', default=LEXICON_FILE_NAME)
+    args = parser.parse_args()
+
+    convert(args.data_file, args.lexicon_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1681 @@
+#!/usr/bin/env python3
+
+import array
+import collections
+import contextlib
+import heapq
+import itertools
+import lexicon
+import math
+import os
+import pickle
+import profiling
+import queue
+import re
+import threading
+import time
+import traceback
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # not on Windows, where the journal is not locked
+
+# numpy, multiprocessing and csv take a while to import and only some
+# backends and export() use them, so they are imported on first use;
+# see import_numpy()
+numpy = None
+
+
+SELECTED_WORDS_FILE_NAME = 'words-selected.pkl'
+SELECTED_NAMES_FILE_NAME = 'names-selected.txt'
+REFUSED_NAMES_FILE_NAME = 'names-refused.txt'
+VOTE_JOURNAL_FILE_NAME = 'names-journal.txt'
+SPELLINGS_FILE_NAME = '.picknames2.data.pkl'
+SELECTED_SPELLING_PAIRS_FILE_NAME = '.picknames2.state.pkl'
+
+# a name is a tuple of one to MAX_NAME_LENGTH words, (w1, w2) being the
+# usual two-word name
+MAX_NAME_LENGTH = 3
+
+
+def import_numpy():
+    # whether numpy is installed, importing it the first time
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+    return True
+
+
+def load_selected_words(file_name=SELECTED_WORDS_FILE_NAME):
+    # {spelling: {sound: [words]}}, as saved by pickwords.py
+    selected_spelling_sound_words_mapping = {}
+    if os.path.exists(file_name):
+        with open(file_name, 'rb') as f:
+            selected_spelling_sound_words_mapping = pickle.load(f)
+    return selected_spelling_sound_words_mapping
+
+
+def spelling_words(selected_spelling_sound_words_mapping, spelling):
+    words = set()
+    for sound, sound_words in selected_spelling_sound_words_mapping[spelling].items():
+        words.update(sound_words)
+    return words
+
+
+def load_spellings(file_name=SPELLINGS_FILE_NAME, lexicon_file_name=lexicon.LEXICON_FILE_NAME):
+    # the same spellings, in the same order, as the compiled lexicon
+    if os.path.exists(lexicon_file_name):
+        lex = lexicon.Lexicon(lexicon_file_name)
+        spellings = list(lex.spellings())
+        lex.close()
+        return spellings
+
+    spellings = []
+    if os.path.exists(file_name):
+        with open(file_name, 'rb') as f:
+            spellings = pickle.load(f)
+    return spellings
+
+
+def load_selected_spelling_pairs(file_name=SELECTED_SPELLING_PAIRS_FILE_NAME):
+    # [(spelling1, spelling2)], as saved by picknames2.py
+    selected_spelling_pairs = []
+    if os.path.exists(file_name):
+        with open(file_name, 'rb') as f:
+            selected_spelling_pairs = pickle.load(f)
+    return selected_spelling_pairs
+
+
+def save_selected_spelling_pairs(file_name, selected_spelling_pairs):
+    # swapped in whole like save_names(), other windows may be reading it
+    temp_file_name = file_name + '.tmp'
+    with open(temp_file_name, 'wb') as f:
+        pickle.dump(list(selected_spelling_pairs), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file_name, file_name)
+
+
+def load_names(file_name):
+    # yields names, one word per character of a line
+    if not os.path.exists(file_name):
+        return
+
+    with open(file_name, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not 1 <= len(line) <= MAX_NAME_LENGTH:
+                continue
+            yield tuple(line)
+
+
+def save_names(file_name, names):
+    # write a new file and swap it in, so a crash never leaves half a file
+    temp_file_name = file_name + '.tmp'
+    with open(temp_file_name, 'w', encoding='utf-8') as f:
+        names = sorted([''.join(name) for name in names])
+        for name in names:
+            f.write(name + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file_name, file_name)
+
+
+def file_stamp(file_name):
+    # (modification time, size), None for a missing file
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class FileWatcher(object):
+
+    # Tells which of some files were written since it last looked, by their
+    # modification times and sizes, cheap enough to ask every second.
+    # A window reloads just what those files hold, see reload_state() of
+    # picknames.py and picknames2.py.
+
+    def __init__(self, file_names):
+        self.stamps = {file_name: file_stamp(file_name) for file_name in file_names}
+
+
+    def changed(self):
+        # the files written since the last call
+        changed = []
+        for file_name, stamp in self.stamps.items():
+            new_stamp = file_stamp(file_name)
+            if new_stamp != stamp:
+                self.stamps[file_name] = new_stamp
+                changed.append(file_name)
+        return changed
+
+
+    def refresh(self, file_names):
+        # written by this process, nothing to reload
+        for file_name in file_names:
+            self.stamps[file_name] = file_stamp(file_name)
+
+
+class VoteJournal(object):
+
+    # Votes are appended as they are cast, one '+名字' (✔) or '-名字' (✖)
+    # line each, '~+名字' or '~-名字' when one is taken back, and fsync()ed
+    # in batches of SYNC_EVERY votes or at least every SYNC_INTERVAL
+    # seconds.  NameRanker compacts the journal into names-selected.txt and
+    # names-refused.txt now and then.
+
+    SYNC_EVERY = 16
+    SYNC_INTERVAL = 1.0
+
+    def __init__(self, file_name=VOTE_JOURNAL_FILE_NAME, read_only=False):
+        # a read_only journal is only replayed, the file is neither created
+        # nor repaired and nothing may be appended
+        self.file_name = file_name
+        self.num_records = 0
+        for record in self.replay():
+            self.num_records += 1
+
+        self.f = None
+        self.num_unsynced = 0
+        self.last_sync = time.monotonic()
+        if read_only:
+            return
+
+        # a crash may have cut the last line short, replay() skips it and
+        # it goes before anything is appended after it
+        if os.path.exists(file_name) and os.path.getsize(file_name) > 0:
+            with open(file_name, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.seek(0)
+                    f.truncate(f.read().rfind(b'\n') + 1)
+
+        self.f = open(file_name, 'a', encoding='utf-8')
+
+
+    def replay(self):
+        # yields (name, selected, taken_back)
+        if not os.path.exists(self.file_name):
+            return
+
+        # a line cut short by a crash may end inside a character
+        with open(self.file_name, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                line = line.decode('utf-8', errors='replace').strip()
+                if '\ufffd' in line:
+                    continue
+                taken_back = line.startswith('~')
+                if taken_back:
+                    line = line[1:]
+                if not 2 <= len(line) <= MAX_NAME_LENGTH + 1 or line[0] not in '+-':
+                    continue
+                yield (tuple(line[1:]), line[0] == '+', taken_back)
+
+
+    @contextlib.contextmanager
+    def locked(self):
+        # other processes append nothing while the journal is locked, so
+        # nothing they write is lost between reading and emptying it
+        if fcntl:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+
+
+    def append(self, name, selected, taken_back=False):
+        record = ('~' if taken_back else '') + ('+' if selected else '-') + ''.join(name) + '\n'
+        with self.locked():
+            self.f.write(record)
+            self.f.flush()
+        self.num_records += 1
+        self.num_unsynced += 1
+
+        if self.num_unsynced >= self.SYNC_EVERY or time.monotonic() - self.last_sync >= self.SYNC_INTERVAL:
+            self.sync()
+
+
+    def sync(self):
+        if not self.f:
+            return
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.num_unsynced = 0
+        self.last_sync = time.monotonic()
+
+
+    def truncate(self):
+        self.f.truncate(0)
+        self.sync()
+        self.num_records = 0
+
+
+    def close(self):
+        if not self.f:
+            return
+        self.sync()
+        self.f.close()
+
+
+class NameSet(object):
+
+    # A set of (w1, w2) names as a packed bit matrix over the interned
+    # vocabulary, bit w2 of row w1, about an eighth of a byte per name
+    # instead of a tuple in a set.  Names with a word outside the
+    # vocabulary, such as votes on words no longer selected, and names of
+    # one or three words are kept in a plain set.  Besides, the set may hold
+    # every name with one of excluded_words, or with a word twice when
+    # exclude_same_word is set, whatever its length; those are in it but
+    # neither counted by len() nor iterated, pairs over the vocabulary are
+    # expected to be added as bits too.
+
+    def __init__(self, word_ids=None, names=()):
+        self.word_ids = word_ids if word_ids is not None else {}
+        self.words = sorted(self.word_ids, key=self.word_ids.get)
+        self.stride = (len(self.words) + 7) // 8 # bytes per row
+        self.bits = bytearray(len(self.words) * self.stride)
+        self.other_names = set()
+        self.size = 0
+        self.excluded_words = set()
+        self.exclude_same_word = False
+        for name in names:
+            self.add(name)
+
+
+    def add(self, name):
+        i = j = None
+        if len(name) == 2:
+            i = self.word_ids.get(name[0])
+            j = self.word_ids.get(name[1])
+        if i is None or j is None:
+            if name not in self.other_names:
+                self.other_names.add(name)
+                self.size += 1
+            return
+
+        k = i * self.stride + (j >> 3)
+        mask = 1 << (j & 7)
+        if not self.bits[k] & mask:
+            self.bits[k] |= mask
+            self.size += 1
+
+
+    def extend(self, word_ids):
+        # over word_ids, which keeps the ids of the current vocabulary and
+        # numbers new words after them; the rows are copied over
+        num_words = len(self.words)
+        (stride, bits) = (self.stride, self.bits)
+        self.word_ids = word_ids
+        self.words = sorted(word_ids, key=word_ids.get)
+        self.stride = (len(self.words) + 7) // 8
+        self.bits = bytearray(len(self.words) * self.stride)
+        for i in range(num_words):
+            self.bits[i * self.stride:i * self.stride + stride] = bits[i * stride:(i + 1) * stride]
+
+        # pairs of the new words go in the matrix now
+        other_names = self.other_names
+        self.other_names = set()
+        self.size -= len(other_names)
+        for name in other_names:
+            self.add(name)
+
+
+    def add_row(self, i, columns):
+        # (words[i], words[j]) for every bit j of the int columns
+        start = i * self.stride
+        old = int.from_bytes(self.bits[start:start + self.stride], 'little')
+        new = old | columns
+        self.bits[start:start + self.stride] = new.to_bytes(self.stride, 'little')
+        self.size += new.bit_count() - old.bit_count()
+
+
+    def update(self, names):
+        # a row at a time when names has the same vocabulary
+        self.excluded_words.update(names.excluded_words)
+        self.exclude_same_word = self.exclude_same_word or names.exclude_same_word
+        if names.word_ids is not self.word_ids:
+            for name in names:
+                self.add(name)
+            return
+
+        for i in range(len(self.words)):
+            start = i * names.stride
+            columns = int.from_bytes(names.bits[start:start + names.stride], 'little')
+            if columns:
+                self.add_row(i, columns)
+        for name in names.other_names:
+            self.add(name)
+
+
+    def discard(self, name):
+        i = j = None
+        if len(name) == 2:
+            i = self.word_ids.get(name[0])
+            j = self.word_ids.get(name[1])
+        if i is None or j is None:
+            if name in self.other_names:
+                self.other_names.remove(name)
+                self.size -= 1
+            return
+
+        k = i * self.stride + (j >> 3)
+        mask = 1 << (j & 7)
+        if self.bits[k] & mask:
+            self.bits[k] &= ~mask
+            self.size -= 1
+
+
+    def count(self, word_lists):
+        # the number of names in the product of word_lists, a row at a time
+        # for pairs
+        if len(word_lists) != 2:
+            n = sum(1 for name in self.other_names if len(name) == len(word_lists) and all(w in words for (w, words) in zip(name, word_lists)) and not self.has_excluded_words(name))
+            return n + self.count_excluded_words(word_lists)
+
+        (words1, words2) = word_lists
+        column_bits = bytearray(self.stride)
+        for w2 in words2:
+            j = self.word_ids.get(w2)
+            if j is not None:
+                column_bits[j >> 3] |= 1 << (j & 7)
+        columns = int.from_bytes(column_bits, 'little')
+
+        n = 0
+        for w1 in words1:
+            i = self.word_ids.get(w1)
+            if i is not None and columns:
+                start = i * self.stride
+                n += (int.from_bytes(self.bits[start:start + self.stride], 'little') & columns).bit_count()
+        for name in self.other_names:
+            if len(name) == 2 and name[0] in words1 and name[1] in words2:
+                n += 1
+        return n
+
+
+    def has_excluded_words(self, name):
+        # by excluded_words and exclude_same_word
+        if self.exclude_same_word and len(set(name)) < len(name):
+            return True
+        return any(w in self.excluded_words for w in name)
+
+
+    def count_excluded_words(self, word_lists):
+        # the number of names in the product of word_lists has_excluded_words()
+        # tells, by inclusion-exclusion over the positions sharing words
+        word_sets = [set(words) for words in word_lists]
+        num_names = math.prod(len(words) for words in word_sets)
+        word_sets = [words - self.excluded_words for words in word_sets]
+        num_allowed_names = math.prod(len(words) for words in word_sets)
+        if self.exclude_same_word and len(word_sets) == 2:
+            (words1, words2) = word_sets
+            num_allowed_names -= len(words1 & words2)
+        elif self.exclude_same_word and len(word_sets) == 3:
+            (words1, words2, words3) = word_sets
+            num_allowed_names -= len(words1 & words2) * len(words3) + len(words1 & words3) * len(words2) + len(words2 & words3) * len(words1)
+            num_allowed_names += 2 * len(words1 & words2 & words3)
+        return num_names - num_allowed_names
+
+
+    def __contains__(self, name):
+        i = j = None
+        if len(name) == 2:
+            i = self.word_ids.get(name[0])
+            j = self.word_ids.get(name[1])
+        if i is None or j is None:
+            return name in self.other_names or self.has_excluded_words(name)
+        return bool(self.bits[i * self.stride + (j >> 3)] & (1 << (j & 7)))
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __iter__(self):
+        # skips the empty bytes in C
+        for match in re.finditer(b'[^\x00]', self.bits):
+            (i, byte) = divmod(match.start(), self.stride)
+            bits = self.bits[match.start()]
+            for bit in range(8):
+                if bits >> bit & 1:
+                    yield (self.words[i], self.words[byte * 8 + bit])
+        for name in self.other_names:
+            yield name
+
+
+class PythonBackend(object):
+
+    # score_name() is separable: a term for the first word plus a term for
+    # the second word.  Instead of scoring every pair, keep the words ordered
+    # by those two terms and walk the implicit sorted score matrix best-first,
+    # so a vote only re-keys the words instead of rebuilding all N * N pairs.
+    # Names of one or three words are walked the same way by iter_best_names().
+
+    def __init__(self, ranker):
+        self.ranker = ranker
+        self.word_keys = [[] for position in range(MAX_NAME_LENGTH)] # by position, then word id
+
+
+    def load_vocabulary(self):
+        pass
+
+
+    def add_name(self, name, selected):
+        pass
+
+
+    def remove_name(self, name):
+        pass
+
+
+    def close(self):
+        pass
+
+
+    @profiling.timed_calls('backend.score')
+    def update(self):
+        r = self.ranker
+        num_selected = len(r.selected_names)
+        num_refused = len(r.refused_names)
+
+        n = len(r.words)
+        for position in range(MAX_NAME_LENGTH):
+            selected_count = r.selected_counts[position]
+            refused_count = r.refused_counts[position]
+            keys = [0.0] * n
+            for i in range(n):
+                key = 0.0
+                if num_selected:
+                    key += float(selected_count[i]) / num_selected
+                if num_refused:
+                    key -= float(refused_count[i]) / num_refused
+                keys[i] = key
+            self.word_keys[position] = keys
+
+
+    def iter_names(self, word_lists):
+        # yields (name, score) of the product of word_lists, best first
+        if len(word_lists) == 2:
+            return self.iter_word_pairs(*word_lists)
+        return iter_best_names(self.ranker, self.word_keys, word_lists)
+
+
+    def iter_word_pairs(self, words1, words2):
+        # yields ((w1, w2), score) of words1 x words2, best first
+        r = self.ranker
+        # an excluded name is bit column_mask of byte row_offset + column_byte of r.excluded_names
+        excluded_bits = r.excluded_names.bits
+        stride = r.excluded_names.stride
+        ids1 = [(w, r.word_ids[w]) for w in words1]
+        ids2 = [(w, r.word_ids[w]) for w in words2]
+        (word1_keys, word2_keys) = self.word_keys[:2]
+        rows = sorted([(word1_keys[i], w, i * stride) for (w, i) in ids1], reverse=True)
+        columns = sorted([(word2_keys[j], w, j >> 3, 1 << (j & 7)) for (w, j) in ids2], reverse=True)
+        if not rows or not columns:
+            return
+
+        # without any selected name, a doubled word scores a flat -1.0
+        same_word_penalty = not r.selected_names
+
+        heap = [(-(rows[0][0] + columns[0][0]), 0, 0)]
+        if same_word_penalty:
+            for k, (key, w, row_offset) in enumerate(rows):
+                if w in words2:
+                    heap.append((1.0, -1, k))
+            heapq.heapify(heap)
+
+        while heap:
+            (score, i, j) = heapq.heappop(heap)
+            if i < 0:
+                w1 = w2 = rows[j][1]
+                k = r.word_ids[w1]
+                if excluded_bits[rows[j][2] + (k >> 3)] & (1 << (k & 7)):
+                    continue
+            else:
+                if j + 1 < len(columns):
+                    heapq.heappush(heap, (-(rows[i][0] + columns[j + 1][0]), i, j + 1))
+                if j == 0 and i + 1 < len(rows):
+                    heapq.heappush(heap, (-(rows[i + 1][0] + columns[0][0]), i + 1, 0))
+                (key, w1, row_offset) = rows[i]
+                (key, w2, column_byte, column_mask) = columns[j]
+                if same_word_penalty and w1 == w2:
+                    continue
+                if excluded_bits[row_offset + column_byte] & column_mask:
+                    continue
+
+            yield ((w1, w2), -score)
+
+
+def iter_best_names(ranker, word_keys, word_lists):
+    # yields (name, score) of the product of word_lists, best first, for any
+    # number of words.  The words of each position are sorted by their term
+    # of the score, so a name's score bounds those of the names with any of
+    # its words moved further down its list.  The walk starts at the best
+    # name and a name is only pushed by the one with the last of its
+    # non-zero positions one word higher, so every name is pushed once and
+    # the heap never holds more than a few names per name yielded.
+    # the words constraints.py takes out of every name are left out here
+    excluded_words = ranker.excluded_names.excluded_words
+    columns = []
+    for position, words in enumerate(word_lists):
+        keys = word_keys[position]
+        columns.append(sorted([(keys[ranker.word_ids[w]], w) for w in words if w not in excluded_words], reverse=True))
+    if not all(columns):
+        return
+    num_positions = len(columns)
+
+    # without any selected name, a name with a word twice scores a flat -1.0
+    same_word_penalty = not ranker.selected_names and num_positions > 1
+    repeated_names = iter([])
+    if same_word_penalty and not ranker.excluded_names.exclude_same_word:
+        repeated_names = iter_repeated_names(ranker, word_lists)
+    repeated = next(repeated_names, None)
+
+    start = (0,) * num_positions
+    heap = [(-sum(column[0][0] for column in columns), start)]
+    while heap:
+        (score, indices) = heapq.heappop(heap)
+        while repeated and -1.0 >= -score:
+            yield (repeated, -1.0)
+            repeated = next(repeated_names, None)
+
+        last = num_positions - 1
+        while last > 0 and indices[last] == 0:
+            last -= 1
+        for position in range(last, num_positions):
+            if indices[position] + 1 < len(columns[position]):
+                child = indices[:position] + (indices[position] + 1,) + indices[position + 1:]
+                heapq.heappush(heap, (-sum(column[k][0] for (column, k) in zip(columns, child)), child))
+
+        name = tuple(columns[position][k][1] for position, k in enumerate(indices))
+        if same_word_penalty and len(set(name)) < num_positions:
+            continue
+        if name in ranker.excluded_names:
+            continue
+        yield (name, -score)
+
+    while repeated:
+        yield (repeated, -1.0)
+        repeated = next(repeated_names, None)
+
+
+def iter_repeated_names(ranker, word_lists):
+    # yields the names of the product of word_lists with a word twice, once
+    # each: by the first two positions sharing it
+    num_positions = len(word_lists)
+    for p in range(num_positions):
+        for q in range(p + 1, num_positions):
+            for w in set(word_lists[p]) & set(word_lists[q]):
+                others = [word_lists[r] for r in range(num_positions) if r not in (p, q)]
+                for rest in itertools.product(*others):
+                    name = list(rest)
+                    name.insert(p, w)
+                    name.insert(q, w)
+                    name = tuple(name)
+                    # an earlier pair of positions has it
+                    if any(name[a] == name[b] for a in range(num_positions) for b in range(a + 1, num_positions) if (a, b) < (p, q)):
+                        continue
+                    if name not in ranker.excluded_names:
+                        yield name
+
+
+class NumpyBackend(object):
+
+    # Same ranking as PythonBackend, computed as a dense score matrix: the
+    # ranker's count arrays are viewed as numpy arrays, the matrix is an
+    # outer sum of the word1 and word2 terms and the excluded names are
+    # masked out by a copy of the ranker's excluded_names bits.  Names of
+    # one or three words are walked by iter_best_names().
+
+    CHUNK_SIZE = 64
+
+    def __init__(self, ranker):
+        import_numpy()
+        self.ranker = ranker
+        self.load_vocabulary()
+
+
+    def load_vocabulary(self):
+        r = self.ranker
+        n = len(r.words)
+        self.words = r.words
+        self.index = r.word_ids
+
+        # views of the ranker's count arrays, which it keeps up to date
+        self.selected_counts = [numpy.frombuffer(count, dtype=numpy.int64) for count in r.selected_counts]
+        self.refused_counts = [numpy.frombuffer(count, dtype=numpy.int64) for count in r.refused_counts]
+
+        # packed like NameSet.bits, row w1 and bit w2
+        self.excluded = self.new_array((n, r.excluded_names.stride), numpy.uint8)
+        self.excluded.reshape(-1)[:] = numpy.frombuffer(r.excluded_names.bits, dtype=numpy.uint8)
+
+        self.word_keys = [self.new_array(n, numpy.float64) for position in range(MAX_NAME_LENGTH)]
+
+
+    def new_array(self, shape, dtype):
+        return numpy.zeros(shape, dtype=dtype)
+
+
+    def close(self):
+        pass
+
+
+    def add_name(self, name, selected):
+        if len(name) == 2 and name[0] in self.index and name[1] in self.index:
+            j = self.index[name[1]]
+            self.excluded[self.index[name[0]], j >> 3] |= 1 << (j & 7)
+
+
+    def remove_name(self, name):
+        if len(name) == 2 and name[0] in self.index and name[1] in self.index:
+            j = self.index[name[1]]
+            self.excluded[self.index[name[0]], j >> 3] &= ~(1 << (j & 7)) & 0xff
+
+
+    @profiling.timed_calls('backend.score')
+    def update(self):
+        r = self.ranker
+        num_selected = len(r.selected_names)
+        num_refused = len(r.refused_names)
+
+        # in place, ProcessPoolBackend shares these arrays
+        for position in range(MAX_NAME_LENGTH):
+            keys = self.word_keys[position]
+            keys.fill(0.0)
+            if num_selected:
+                keys += self.selected_counts[position] / float(num_selected)
+            if num_refused:
+                keys -= self.refused_counts[position] / float(num_refused)
+
+
+    def iter_names(self, word_lists):
+        # yields (name, score) of the product of word_lists, best first
+        if len(word_lists) == 2:
+            return self.iter_word_pairs(*word_lists)
+        return iter_best_names(self.ranker, [keys.tolist() for keys in self.word_keys], word_lists)
+
+
+    def iter_word_pairs(self, words1, words2):
+        # yields ((w1, w2), score) of words1 x words2, best first, partitioning
+        # out a growing chunk at a time so the matrix is never fully sorted
+        rows = numpy.fromiter((self.index[w] for w in words1), dtype=numpy.intp, count=len(words1))
+        columns = numpy.fromiter((self.index[w] for w in words2), dtype=numpy.intp, count=len(words2))
+
+        scores = numpy.add.outer(self.word_keys[0][rows], self.word_keys[1][columns])
+        if not self.ranker.selected_names:
+            scores[rows[:, None] == columns[None, :]] = -1.0
+        excluded = unpack_rows(self.excluded, rows, len(self.words))[:, columns]
+        numpy.copyto(scores, -numpy.inf, where=excluded)
+
+        flat = scores.reshape(-1)
+        total = flat.size - int(numpy.count_nonzero(excluded))
+        start = 0
+        chunk_size = self.CHUNK_SIZE
+        while start < total:
+            end = min(start + chunk_size, total)
+            # ties in row-major order, so that chunks never overlap
+            if end < flat.size:
+                kth = -numpy.partition(-flat, end - 1)[end - 1]
+                better = numpy.flatnonzero(flat > kth)
+                ties = numpy.flatnonzero(flat == kth)[:end - len(better)]
+                top = numpy.concatenate([better, ties])
+            else:
+                top = numpy.arange(flat.size)
+            top = top[numpy.lexsort((top, -flat[top]))][start:end]
+            for k in top:
+                i, j = divmod(int(k), len(columns))
+                yield ((self.words[rows[i]], self.words[columns[j]]), float(flat[k]))
+            start = end
+            chunk_size *= 2
+
+
+def unpack_rows(bits, rows, n):
+    # rows of a packed bit matrix as a bool array of n columns
+    return numpy.unpackbits(bits[rows], axis=1, count=n, bitorder='little').view(bool)
+
+
+class ProcessPoolBackend(NumpyBackend):
+
+    # NumpyBackend with the score matrix split by first word across a
+    # process pool.  The key arrays and the excluded mask live in shared
+    # memory, so a task only carries its shard of rows and the columns.
+    # Every shard returns its own best scores and they are merged here.
+    # Ties are broken by position, so a bigger chunk never reorders what an
+    # earlier one yielded.
+
+    def __init__(self, ranker, max_workers=None):
+        import concurrent.futures
+        import multiprocessing
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # spawned, a window's threads are not forked into the workers
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.max_workers, multiprocessing.get_context('spawn'))
+        self.shared_memories = []
+        self.shared_arrays = []   # (shared memory name, shape, dtype) of each new_array()
+        NumpyBackend.__init__(self, ranker)
+
+
+    def load_vocabulary(self):
+        self.release_shared_memories()
+        NumpyBackend.load_vocabulary(self)
+        # in the order NumpyBackend.load_vocabulary() makes them, the
+        # shards only score pairs
+        (excluded, word1_keys, word2_keys) = self.shared_arrays[:3]
+        self.arrays = (word1_keys, word2_keys, excluded)
+
+
+    def new_array(self, shape, dtype):
+        from multiprocessing import shared_memory
+
+        dtype = numpy.dtype(dtype)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, int(numpy.prod(shape)) * dtype.itemsize))
+        self.shared_memories.append(shm)
+        self.shared_arrays.append((shm.name, shape, dtype.str))
+        array = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array.fill(0)
+        return array
+
+
+    def release_shared_memories(self):
+        # the arrays over them go first
+        self.excluded = None
+        self.word_keys = []
+        for shm in self.shared_memories:
+            shm.close()
+            shm.unlink()
+        self.shared_memories = []
+        self.shared_arrays = []
+
+
+    def close(self):
+        self.pool.shutdown()
+        self.release_shared_memories()
+
+
+    def iter_word_pairs(self, words1, words2):
+        # yields ((w1, w2), score) of words1 x words2, best first
+        rows = numpy.fromiter((self.index[w] for w in words1), dtype=numpy.intp, count=len(words1))
+        columns = numpy.fromiter((self.index[w] for w in words2), dtype=numpy.intp, count=len(words2))
+        if not len(rows) or not len(columns):
+            return
+
+        shards = numpy.array_split(rows, min(len(rows), self.max_workers))
+        same_word_penalty = not self.ranker.selected_names
+
+        start = 0
+        limit = self.CHUNK_SIZE
+        while True:
+            futures = [self.pool.submit(score_shard, self.arrays, shard, columns, limit, same_word_penalty) for shard in shards]
+            results = [future.result() for future in futures]
+            scores = numpy.concatenate([result[0] for result in results])
+            word1_ids = numpy.concatenate([result[1] for result in results])
+            word2_ids = numpy.concatenate([result[2] for result in results])
+
+            top = numpy.argsort(-scores, kind='stable')[:limit]
+            for k in top[start:]:
+                yield ((self.words[word1_ids[k]], self.words[word2_ids[k]]), float(scores[k]))
+            if len(top) < limit:
+                return
+            start = limit
+            limit *= 2
+
+
+attached_shared_memories = {}   # in a pool process, shared memory name: (SharedMemory, array)
+
+
+def attach_shared_array(name, shape, dtype):
+    from multiprocessing import shared_memory
+
+    if name not in attached_shared_memories:
+        shm = shared_memory.SharedMemory(name=name)
+        attached_shared_memories[name] = (shm, numpy.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    return attached_shared_memories[name][1]
+
+
+def score_shard(arrays, rows, columns, limit, same_word_penalty):
+    # the best limit names of rows x columns as (scores, word1 ids, word2
+    # ids), best first and ties in row-major order
+    import_numpy()
+    for name in list(attached_shared_memories):
+        if name not in [array[0] for array in arrays]:
+            (shm, array) = attached_shared_memories.pop(name)
+            del array
+            shm.close()
+    (word1_keys, word2_keys, excluded) = [attach_shared_array(*array) for array in arrays]
+
+    scores = numpy.add.outer(word1_keys[rows], word2_keys[columns])
+    if same_word_penalty:
+        scores[rows[:, None] == columns[None, :]] = -1.0
+    mask = unpack_rows(excluded, rows, len(word1_keys))[:, columns]
+    numpy.copyto(scores, -numpy.inf, where=mask)
+
+    flat = scores.reshape(-1)
+    limit = min(limit, flat.size - int(numpy.count_nonzero(mask)))
+    if limit <= 0:
+        top = numpy.zeros(0, dtype=numpy.intp)
+    elif limit < flat.size:
+        kth = -numpy.partition(-flat, limit - 1)[limit - 1]
+        better = numpy.flatnonzero(flat > kth)
+        ties = numpy.flatnonzero(flat == kth)[:limit - len(better)]
+        top = numpy.concatenate([better, ties])
+    else:
+        top = numpy.arange(flat.size)
+    top = top[numpy.lexsort((top, -flat[top]))]
+    return (flat[top], rows[top // len(columns)], columns[top % len(columns)])
+
+
+class NameRanker(object):
+
+    # The ranking state shared by picknames.py and picknames2.py, without
+    # any Tk in it.  The candidate names are the union of name blocks, the
+    # product of a list of words per position: picknames.py has one block
+    # of all candidate words per name length, picknames2.py one
+    # (words1, words2) block per selected spelling pair.
+    #
+    #   ranker = NameRanker()
+    #   ranker.load_vocabulary(words)
+    #   ranker.filter_names(constraints.load_filter(mapping, ranker.word_ids))
+    #   ranker.add_names(2, [words, words])
+    #   ranker.load_votes()
+    #   ranker.update()
+    #   (name, score) = ranker.next_candidate()
+    #   ranker.record_vote(name, selected=False)
+    #   ranker.update()
+    #   ranker.close()
+
+    TOP_K = 100
+
+    # compact the journal once it holds this many votes and at least as
+    # many as the snapshot files, which keeps saving O(1) per vote
+    COMPACT_MIN = 1000
+
+    # votes that can be taken back with undo_vote()
+    UNDO_LIMIT = 1000
+
+    # what load_vocabulary(), filter_names(), add_names() and load_votes()
+    # build, see get_loaded_state()
+    LOADED_STATE = ('candidate_words', 'words', 'word_ids', 'name_blocks', 'word_name_blocks', 'num_candidate_names',
+                    'selected_counts', 'refused_counts', 'selected_names', 'refused_names', 'excluded_names', 'filtered_names')
+
+    def __init__(self, backend_class=PythonBackend, top_k=TOP_K):
+        self.backend_class = backend_class
+        self.top_k_size = top_k
+        self.journal = None
+        self.store = None
+        self.backend = None
+        self.reset_state()
+
+
+    def reset_state(self):
+        self.close()
+        self.selected_names_file_name = SELECTED_NAMES_FILE_NAME
+        self.refused_names_file_name = REFUSED_NAMES_FILE_NAME
+
+        self.candidate_words = set()
+        self.words = []     # candidate_words, interned
+        self.word_ids = {}  # w: its index in words
+        self.name_blocks = {}   # key: [word_lists, number of excluded names in their product]
+        # by name length and position, w: keys of the blocks with w there
+        self.word_name_blocks = [[{} for position in range(length)] for length in range(MAX_NAME_LENGTH + 1)]
+        self.num_candidate_names = 0
+
+        # votes per position and word id; a word counts where it is in the
+        # names voted on, whatever their length
+        self.selected_counts = [array.array('q') for position in range(MAX_NAME_LENGTH)]
+        self.refused_counts = [array.array('q') for position in range(MAX_NAME_LENGTH)]
+        self.refused_names = NameSet()
+        self.selected_names = NameSet()
+        self.excluded_names = NameSet() # both of them, and the names filter_names() takes out
+        self.filtered_names = NameSet() # the names filter_names() takes out
+
+        # Each vote cast since loading as the delta it made,
+        # (name, selected, was voted), so undo_vote() reverts
+        # just that instead of reloading; undone votes as (name, selected)
+        self.vote_deltas = collections.deque(maxlen=self.UNDO_LIMIT)
+        self.undone_votes = []
+        # (name, selected): whether the journal last casts or takes back
+        # that vote, for what this ranker journaled since it last compacted
+        self.unsaved_votes = {}
+
+        # The ranking is a merge of one best-first iterator per name block.
+        # candidate_heap holds the head of each iterator as
+        # (-score, name, serial, key); entries whose serial is no longer
+        # the one in name_block_iters belong to a removed block.
+        self.ranked = False
+        self.serials = itertools.count()
+        self.name_block_iters = {}  # key: (serial, iterator)
+        self.candidate_heap = []
+        self.candidate_names_with_score = []    # next top_k entries off candidate_heap, best last
+        self.candidate_entry = None # the entry last handed out by next_candidate()
+
+        self.backend = self.backend_class(self)
+
+
+    @profiling.timed_calls('ranker.load_vocabulary')
+    def load_vocabulary(self, words):
+        self.candidate_words = set(words)
+        self.words = sorted(self.candidate_words)
+        self.word_ids = {w: i for i, w in enumerate(self.words)}
+        self.selected_names = NameSet(self.word_ids, self.selected_names)
+        self.refused_names = NameSet(self.word_ids, self.refused_names)
+        self.excluded_names = NameSet(self.word_ids, self.excluded_names)
+        self.filtered_names = NameSet(self.word_ids, self.filtered_names)
+
+        n = len(self.words)
+        self.selected_counts = [array.array('q', bytes(8 * n)) for position in range(MAX_NAME_LENGTH)]
+        self.refused_counts = [array.array('q', bytes(8 * n)) for position in range(MAX_NAME_LENGTH)]
+        for (names, counts) in ((self.selected_names, self.selected_counts), (self.refused_names, self.refused_counts)):
+            for name in names:
+                self.count_name(name, counts)
+        self.backend.load_vocabulary()
+
+
+    @profiling.timed_calls('ranker.add_vocabulary')
+    def add_vocabulary(self, words):
+        # the words not in the vocabulary yet, numbered after it, so that the
+        # name sets are widened instead of built again; ranked again by the
+        # next update().  Words are never taken out, their names are.
+        added_words = set(words) - self.candidate_words
+        if not added_words:
+            return
+
+        new_words = sorted(added_words)
+        self.candidate_words = self.candidate_words | added_words
+        self.words = self.words + new_words
+        self.word_ids = dict(self.word_ids)
+        for w in new_words:
+            self.word_ids[w] = len(self.word_ids)
+
+        # the votes on names of the new words were kept, never counted
+        for (names, counts) in ((self.selected_names, self.selected_counts), (self.refused_names, self.refused_counts)):
+            for position in range(MAX_NAME_LENGTH):
+                counts[position] = counts[position] + array.array('q', bytes(8 * len(new_words)))
+            for name in names.other_names:
+                for position, w in enumerate(name):
+                    if w in added_words:
+                        counts[position][self.word_ids[w]] += 1
+
+        for names in (self.selected_names, self.refused_names, self.excluded_names, self.filtered_names):
+            names.extend(self.word_ids)
+        self.backend.load_vocabulary()
+        self.ranked = False
+
+
+    @profiling.timed_calls('ranker.add_names')
+    def add_names(self, key, word_lists):
+        # the names of the product of word_lists, one list per position
+        num_excluded_names = self.excluded_names.count(word_lists)
+        self.name_blocks[key] = [word_lists, num_excluded_names]
+        self.num_candidate_names += math.prod(len(words) for words in word_lists) - num_excluded_names
+        for position, words in enumerate(word_lists):
+            word_name_blocks = self.word_name_blocks[len(word_lists)][position]
+            for w in words:
+                word_name_blocks.setdefault(w, set()).add(key)
+
+        # merge just this block into the current ranking
+        if self.ranked:
+            self.requeue_candidates()
+            self.start_name_block(key)
+
+
+    def remove_names(self, key):
+        (word_lists, num_excluded_names) = self.name_blocks.pop(key)
+        self.num_candidate_names -= math.prod(len(words) for words in word_lists) - num_excluded_names
+        for position, words in enumerate(word_lists):
+            word_name_blocks = self.word_name_blocks[len(word_lists)][position]
+            for w in words:
+                word_name_blocks[w].discard(key)
+
+        # its entries left in candidate_heap are skipped from now on
+        if self.ranked:
+            self.name_block_iters.pop(key, None)
+            self.requeue_candidates()
+
+
+    def add_word_pairs(self, key, words1, words2):
+        self.add_names(key, [words1, words2])
+
+
+    def remove_word_pairs(self, key):
+        self.remove_names(key)
+
+
+    @profiling.timed_calls('ranker.filter_names')
+    def filter_names(self, names):
+        # names never to be offered nor counted, such as a NameSet compiled
+        # by constraints.py over word_ids; before the votes are loaded
+        self.excluded_names.update(names)
+        self.filtered_names.update(names)
+        self.backend.load_vocabulary()
+
+        # recount the blocks added before
+        for key in list(self.name_blocks):
+            (word_lists, num_excluded_names) = self.name_blocks[key]
+            self.remove_names(key)
+            self.add_names(key, word_lists)
+
+
+    @profiling.timed_calls('ranker.refilter_names')
+    def refilter_names(self, names):
+        # filter_names() with names in place of all the names filtered before,
+        # as when the constraints or the selected words changed
+        self.excluded_names = NameSet(self.word_ids)
+        self.excluded_names.update(self.selected_names)
+        self.excluded_names.update(self.refused_names)
+        self.filtered_names = NameSet(self.word_ids)
+        self.filter_names(names)
+
+
+    @profiling.timed_calls('ranker.load_votes')
+    def load_votes(self, selected_names_file_name=SELECTED_NAMES_FILE_NAME, refused_names_file_name=REFUSED_NAMES_FILE_NAME, journal_file_name=VOTE_JOURNAL_FILE_NAME, store=None, read_only=False):
+        # the snapshot files, then the votes journaled since they were written,
+        # or the votes table of a statestore.StateStore; read_only leaves the
+        # journal as it is, for a ranker that never votes
+        if store:
+            self.store = store
+        else:
+            self.selected_names_file_name = selected_names_file_name
+            self.refused_names_file_name = refused_names_file_name
+            if journal_file_name:
+                self.journal = VoteJournal(journal_file_name, read_only)
+
+        for (name, selected) in self.iter_saved_votes():
+            if selected and name not in self.selected_names:
+                self.add_selected_name(name)
+            elif not selected and name not in self.refused_names:
+                self.add_refused_name(name)
+
+
+    def read_journal_votes(self):
+        # {(name, selected): whether the journal last casts or takes back that vote}
+        journal_votes = {}
+        if self.journal:
+            for (name, selected, taken_back) in self.journal.replay():
+                journal_votes[(name, selected)] = not taken_back
+        return journal_votes
+
+
+    def iter_saved_votes(self, journal_votes=None):
+        # yields (name, selected) of the votes in the store, or in the
+        # snapshot files and the journal; a name may come twice
+        if self.store:
+            yield from self.store.load_votes()
+            return
+
+        if journal_votes is None:
+            journal_votes = self.read_journal_votes()
+
+        for name in load_names(self.selected_names_file_name):
+            if journal_votes.get((name, True), True):
+                yield (name, True)
+        for name in load_names(self.refused_names_file_name):
+            if journal_votes.get((name, False), True):
+                yield (name, False)
+
+        # already in the snapshot if a compaction was cut short
+        for ((name, selected), cast) in journal_votes.items():
+            if cast:
+                yield (name, selected)
+
+
+    @profiling.timed_calls('ranker.reload_votes')
+    def reload_votes(self):
+        # the saved votes cast or taken back by someone else since loading,
+        # as deltas; returns the number of them.  undo_vote() has nothing to
+        # take back after any.
+        saved_selected_names = NameSet(self.word_ids)
+        saved_refused_names = NameSet(self.word_ids)
+        for (name, selected) in self.iter_saved_votes():
+            if selected:
+                saved_selected_names.add(name)
+            else:
+                saved_refused_names.add(name)
+
+        # what this ranker journaled since it last compacted stays, even
+        # if another process emptied the journal
+        taken_back = [(name, True) for name in self.selected_names if name not in saved_selected_names and not self.unsaved_votes.get((name, True))]
+        taken_back += [(name, False) for name in self.refused_names if name not in saved_refused_names and not self.unsaved_votes.get((name, False))]
+        cast = [(name, True) for name in saved_selected_names if name not in self.selected_names and self.unsaved_votes.get((name, True), True)]
+        cast += [(name, False) for name in saved_refused_names if name not in self.refused_names and self.unsaved_votes.get((name, False), True)]
+        for (name, selected) in taken_back:
+            if selected:
+                self.remove_selected_name(name)
+            else:
+                self.remove_refused_name(name)
+        for (name, selected) in cast:
+            if selected:
+                self.add_selected_name(name)
+            else:
+                self.add_refused_name(name)
+
+        if taken_back or cast:
+            self.vote_deltas.clear()
+            self.undone_votes = []
+        return len(taken_back) + len(cast)
+
+
+    def get_loaded_state(self):
+        # {attribute: value} of LOADED_STATE, for rankcache.py to pickle;
+        # the journal and the store are not in it
+        return {attribute: getattr(self, attribute) for attribute in self.LOADED_STATE}
+
+
+    @profiling.timed_calls('ranker.set_loaded_state')
+    def set_loaded_state(self, state, selected_names_file_name=SELECTED_NAMES_FILE_NAME, refused_names_file_name=REFUSED_NAMES_FILE_NAME, journal_file_name=VOTE_JOURNAL_FILE_NAME):
+        # in place of loading the files get_loaded_state() was saved from
+        for attribute in self.LOADED_STATE:
+            setattr(self, attribute, state[attribute])
+        self.backend.load_vocabulary()
+
+        self.selected_names_file_name = selected_names_file_name
+        self.refused_names_file_name = refused_names_file_name
+        if journal_file_name:
+            self.journal = VoteJournal(journal_file_name)
+
+
+    @profiling.timed_calls('ranker.save_votes')
+    def save_votes(self, selected_names_file_name=None, refused_names_file_name=None):
+        # every vote is in the journal already, saving only makes sure it is
+        # on disk; without a journal, write the snapshot files.  A store
+        # already has every vote.
+        if self.store:
+            return
+        if self.journal:
+            self.journal.sync()
+            return
+        save_names(selected_names_file_name or self.selected_names_file_name, self.selected_names)
+        save_names(refused_names_file_name or self.refused_names_file_name, self.refused_names)
+
+
+    @profiling.timed_calls('ranker.compact_votes')
+    def compact_votes(self, selected_names_file_name=None, refused_names_file_name=None):
+        # write the snapshot files and empty the journal, once the journal is
+        # as long as the snapshot.  Other processes share the files and the
+        # journal, so the snapshot is the saved votes merged with this
+        # ranker's; returns the number of votes in which it differs from
+        # this ranker.
+        if not self.journal:
+            self.save_votes(selected_names_file_name, refused_names_file_name)
+            return 0
+
+        selected_names_file_name = selected_names_file_name or self.selected_names_file_name
+        refused_names_file_name = refused_names_file_name or self.refused_names_file_name
+        with self.journal.locked():
+            journal_votes = self.read_journal_votes()
+            merged_selected_names = NameSet(self.word_ids)
+            merged_refused_names = NameSet(self.word_ids)
+            for (name, selected) in self.iter_saved_votes(journal_votes):
+                if selected:
+                    merged_selected_names.add(name)
+                else:
+                    merged_refused_names.add(name)
+            num_changed = len(merged_selected_names) + len(merged_refused_names)
+
+            # but for what the journal takes back
+            for name in self.selected_names:
+                if name in merged_selected_names:
+                    num_changed -= 1
+                elif journal_votes.get((name, True), True):
+                    merged_selected_names.add(name)
+                else:
+                    num_changed += 1
+            for name in self.refused_names:
+                if name in merged_refused_names:
+                    num_changed -= 1
+                elif journal_votes.get((name, False), True):
+                    merged_refused_names.add(name)
+                else:
+                    num_changed += 1
+
+            save_names(selected_names_file_name, merged_selected_names)
+            save_names(refused_names_file_name, merged_refused_names)
+            self.journal.truncate()
+        self.unsaved_votes.clear()
+        return num_changed
+
+
+    def close(self):
+        # the store belongs to whoever opened it
+        if self.journal:
+            self.journal.close()
+        self.journal = None
+        self.store = None
+        if self.backend:
+            self.backend.close()
+        self.backend = None
+
+
+    def record_vote(self, name, selected):
+        profiling.profiler.count('ranker.votes')
+        self.cast_vote(name, selected)
+        self.undone_votes = []
+
+
+    def cast_vote(self, name, selected):
+        was_voted = name in (self.selected_names if selected else self.refused_names)
+        if selected:
+            self.add_selected_name(name)
+        else:
+            self.add_refused_name(name)
+        self.vote_deltas.append((name, selected, was_voted))
+        self.write_vote(name, selected)
+
+
+    def write_vote(self, name, selected, taken_back=False):
+        if self.store:
+            if taken_back:
+                self.store.retract_vote(name, selected)
+            else:
+                self.store.record_vote(name, selected)
+        if self.journal:
+            self.journal.append(name, selected, taken_back)
+            self.unsaved_votes[(name, selected)] = not taken_back
+            if self.journal.num_records >= max(self.COMPACT_MIN, len(self.selected_names) + len(self.refused_names)):
+                self.compact_votes()
+
+
+    def undo_vote(self):
+        # takes back the last vote, returns (name, selected) or None
+        if not self.vote_deltas:
+            return None
+
+        (name, selected, was_voted) = self.vote_deltas.pop()
+        if selected:
+            self.count_name(name, self.selected_counts, -1)
+            if not was_voted:
+                self.selected_names.discard(name)
+        else:
+            self.count_name(name, self.refused_counts, -1)
+            if not was_voted:
+                self.refused_names.discard(name)
+        # by the filter as it is now, refilter_names() may have changed it
+        if name in self.excluded_names and name not in self.selected_names and name not in self.refused_names and name not in self.filtered_names:
+            self.include_name(name)
+
+        self.undone_votes.append((name, selected))
+        if not was_voted:
+            self.write_vote(name, selected, taken_back=True)
+        return (name, selected)
+
+
+    def redo_vote(self):
+        # casts the last vote undone again, returns (name, selected) or None
+        if not self.undone_votes:
+            return None
+
+        (name, selected) = self.undone_votes.pop()
+        self.cast_vote(name, selected)
+        return (name, selected)
+
+
+    def name_block_keys(self, name):
+        # the keys of the blocks name is a candidate of
+        word_name_blocks = self.word_name_blocks[len(name)]
+        keys = word_name_blocks[0].get(name[0], ())
+        for position in range(1, len(name)):
+            if not keys:
+                break
+            keys = word_name_blocks[position].get(name[position], set()) & keys
+        return keys
+
+
+    def exclude_name(self, name):
+        if name in self.excluded_names:
+            return
+        self.excluded_names.add(name)
+
+        for key in self.name_block_keys(name):
+            self.name_blocks[key][1] += 1
+            self.num_candidate_names -= 1
+
+
+    def include_name(self, name):
+        # a candidate again, the reverse of exclude_name()
+        self.excluded_names.discard(name)
+        self.backend.remove_name(name)
+
+        for key in self.name_block_keys(name):
+            self.name_blocks[key][1] -= 1
+            self.num_candidate_names += 1
+
+
+    def count_name(self, name, counts, delta=1):
+        # words outside the vocabulary are never scored
+        for position, w in enumerate(name):
+            i = self.word_ids.get(w)
+            if i is not None:
+                counts[position][i] += delta
+
+
+    def add_selected_name(self, name):
+        self.exclude_name(name)
+        self.count_name(name, self.selected_counts)
+        self.selected_names.add(name)
+        self.backend.add_name(name, True)
+
+
+    def add_refused_name(self, name):
+        self.exclude_name(name)
+        self.count_name(name, self.refused_counts)
+        self.refused_names.add(name)
+        self.backend.add_name(name, False)
+
+
+    def remove_selected_name(self, name):
+        # the reverse of add_selected_name()
+        self.count_name(name, self.selected_counts, -1)
+        self.selected_names.discard(name)
+        if name not in self.refused_names and name not in self.filtered_names:
+            self.include_name(name)
+
+
+    def remove_refused_name(self, name):
+        self.count_name(name, self.refused_counts, -1)
+        self.refused_names.discard(name)
+        if name not in self.selected_names and name not in self.filtered_names:
+            self.include_name(name)
+
+
+    def score_name(self, name):
+        # a term per word, by its position
+        if not self.selected_names and len(set(name)) < len(name):
+            return -1.0
+
+        score = 0
+        for position, w in enumerate(name):
+            i = self.word_ids.get(w)
+            if i is None:
+                continue
+            if self.selected_names:
+                score += float(self.selected_counts[position][i]) / len(self.selected_names)
+            if self.refused_names:
+                score -= float(self.refused_counts[position][i]) / len(self.refused_names)
+        return score
+
+
+    def num_candidates(self):
+        return self.num_candidate_names
+
+
+    @profiling.timed_calls('ranker.update')
+    def update(self):
+        # re-rank after votes; candidates handed out before are stale
+        self.backend.update()
+        self.ranked = True
+        self.name_block_iters = {}
+        self.candidate_heap = []
+        self.candidate_names_with_score = []
+        self.candidate_entry = None
+        for key in self.name_blocks:
+            self.start_name_block(key)
+
+
+    def start_name_block(self, key):
+        (word_lists, num_excluded_names) = self.name_blocks[key]
+        serial = next(self.serials)
+        iterator = self.backend.iter_names(word_lists)
+        self.name_block_iters[key] = (serial, iterator)
+        self.advance_name_block(key, serial, iterator)
+
+
+    def advance_name_block(self, key, serial, iterator):
+        candidate = next(iterator, None)
+        if candidate:
+            (name, score) = candidate
+            heapq.heappush(self.candidate_heap, (-score, name, serial, key))
+
+
+    def is_live_entry(self, entry):
+        (score, name, serial, key) = entry
+        if key not in self.name_block_iters or self.name_block_iters[key][0] != serial:
+            return False
+        return name not in self.excluded_names
+
+
+    @profiling.timed_calls('ranker.take_candidates')
+    def take_candidates(self, k):
+        entries = []
+        while self.candidate_heap and len(entries) < k:
+            entry = heapq.heappop(self.candidate_heap)
+            (score, name, serial, key) = entry
+            if key not in self.name_block_iters or self.name_block_iters[key][0] != serial:
+                continue
+            self.advance_name_block(key, serial, self.name_block_iters[key][1])
+            if self.is_live_entry(entry):
+                entries.append(entry)
+        return entries
+
+
+    def requeue_candidates(self):
+        # put the buffered candidates and the one last handed out back into
+        # candidate_heap, so a changed candidate space can outrank them
+        entries = self.candidate_names_with_score
+        if self.candidate_entry:
+            entries.append(self.candidate_entry)
+        for entry in entries:
+            if self.is_live_entry(entry):
+                heapq.heappush(self.candidate_heap, entry)
+        self.candidate_names_with_score = []
+        self.candidate_entry = None
+
+
+    def iter_candidate_names_with_score(self):
+        # yields (name, score), best first, as of the last update()
+        iters = [self.backend.iter_names(word_lists) for (word_lists, n) in self.name_blocks.values()]
+        if len(iters) == 1:
+            return iters[0]
+        return heapq.merge(*iters, key=lambda tup: tup[1], reverse=True)
+
+
+    def next_candidate(self):
+        if not self.candidate_names_with_score:
+            self.candidate_names_with_score = self.take_candidates(self.top_k_size)
+            self.candidate_names_with_score.reverse()
+
+        self.candidate_entry = None
+        if self.candidate_names_with_score:
+            self.candidate_entry = self.candidate_names_with_score.pop()
+            (score, name, serial, key) = self.candidate_entry
+            return (name, -score)
+        return None
+
+
+    def peek_candidates(self, k):
+        # the next k (name, score), left in place for next_candidate()
+        self.requeue_candidates()
+        entries = self.take_candidates(k)
+        for entry in entries:
+            heapq.heappush(self.candidate_heap, entry)
+        return [(name, -score) for (score, name, serial, key) in entries]
+
+
+    def iter_name_block_with_key(self, key):
+        (word_lists, num_excluded_names) = self.name_blocks[key]
+        for (name, score) in self.backend.iter_names(word_lists):
+            yield (name, score, key)
+
+
+    def iter_candidate_names_with_key(self):
+        # yields (name, score, key of the name block), best first, as of the last update()
+        iters = [self.iter_name_block_with_key(key) for key in self.name_blocks]
+        return heapq.merge(*iters, key=lambda tup: tup[1], reverse=True)
+
+
+    def top_k(self, k):
+        return list(itertools.islice(self.iter_candidate_names_with_score(), k))
+
+
+    def export(self, f, limit=None):
+        # writes name,score rows, best first
+        import csv
+
+        writer = csv.writer(f)
+        for (name, score) in itertools.islice(self.iter_candidate_names_with_score(), limit):
+            writer.writerow([''.join(name), score])
+
+
+def selected_words(selected_spelling_sound_words_mapping):
+    words = set()
+    for spelling in selected_spelling_sound_words_mapping:
+        words.update(spelling_words(selected_spelling_sound_words_mapping, spelling))
+    return words
+
+
+def load_candidate_names(ranker, selected_spelling_sound_words_mapping, name_lengths=(2,), word_pairs=None, constraints_file_name=None):
+    # the vocabulary, the constraints and the names of the selected words:
+    # every name of name_lengths words or, given word_pairs {key: (words1,
+    # words2)} as picknames2 has for its spelling pairs, only those.  A
+    # ranker with a vocabulary takes just what changed, and
+    # selected_spelling_sound_words_mapping is None when the words did not.
+    import constraints # which imports this module
+    words = None
+    if selected_spelling_sound_words_mapping is not None:
+        words = selected_words(selected_spelling_sound_words_mapping)
+        loaded = bool(ranker.words)
+        if loaded:
+            ranker.add_vocabulary(words)
+        else:
+            ranker.load_vocabulary(words)
+        names = constraints.load_filter(selected_spelling_sound_words_mapping, ranker.word_ids, constraints_file_name or constraints.CONSTRAINTS_FILE_NAME)
+        if loaded:
+            ranker.refilter_names(names)
+        else:
+            ranker.filter_names(names)
+
+    if word_pairs is not None:
+        name_blocks = {key: list(word_lists) for (key, word_lists) in word_pairs.items()}
+    elif words is not None:
+        name_blocks = {length: [words] * length for length in name_lengths}
+    else:
+        return
+    # only the blocks whose words differ are put back
+    for (key, (word_lists, num_excluded_names)) in list(ranker.name_blocks.items()):
+        if name_blocks.get(key) != word_lists:
+            ranker.remove_names(key)
+    for (key, word_lists) in name_blocks.items():
+        if key not in ranker.name_blocks:
+            ranker.add_names(key, word_lists)
+
+
+def load_ranker(tool='picknames', backend_class=PythonBackend, top_k=NameRanker.TOP_K, store=None, name_lengths=(2,), read_only=False):
+    # what load_ranker_files() of picknames.py, or of picknames2.py with the
+    # saved spelling pairs, does minus the window; returns (ranker,
+    # selected_spelling_sound_words_mapping).  A read_only ranker only reads
+    # the votes.
+    ranker = NameRanker(backend_class, top_k)
+    if store:
+        selected_spelling_sound_words_mapping = store.load_selected_words()
+    else:
+        selected_spelling_sound_words_mapping = load_selected_words()
+
+    word_pairs = None
+    if tool == 'picknames2':
+        if store:
+            selected_spelling_pairs = store.load_selected_spelling_pairs()
+        else:
+            selected_spelling_pairs = load_selected_spelling_pairs()
+        word_pairs = {}
+        for (spelling1, spelling2) in selected_spelling_pairs:
+            if spelling1 in selected_spelling_sound_words_mapping and spelling2 in selected_spelling_sound_words_mapping:
+                word_pairs[(spelling1, spelling2)] = (spelling_words(selected_spelling_sound_words_mapping, spelling1), spelling_words(selected_spelling_sound_words_mapping, spelling2))
+    load_candidate_names(ranker, selected_spelling_sound_words_mapping, name_lengths, word_pairs)
+
+    ranker.load_votes(store=store, read_only=read_only)
+    return (ranker, selected_spelling_sound_words_mapping)
+
+
+class RankingWorker(object):
+
+    # Runs changes to a NameRanker on a thread of its own, so a window
+    # never waits for a re-rank.  Changes queued while one batch is being
+    # handled are applied together with a single update().  After each batch
+    # the worker posts (serial, candidates, number of candidates, error),
+    # serial being the number of changes applied so far and error the last
+    # exception a change or the update raised in that batch, or None; poll()
+    # it with after().  A change that raises counts as applied and the
+    # worker goes on with the next.
+
+    PREFETCH = 8
+
+
+    def __init__(self, ranker, prefetch=PREFETCH):
+        self.ranker = ranker
+        self.prefetch = prefetch
+        self.num_submitted = 0
+        self.requests = queue.Queue()   # (function, args, update), None to stop
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, function, args=(), update=True):
+        # function(*args) on the worker thread; the ranker is only touched there
+        self.num_submitted += 1
+        self.requests.put((function, args, update))
+        return self.num_submitted
+
+
+    def run(self):
+        num_done = 0
+        stopping = False
+        while not stopping:
+            requests = [self.requests.get()]
+            while True:
+                try:
+                    requests.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            # cProfile'd when profiling.profiler.profile_next() asked for it
+            with profiling.profiler.profiled(), profiling.profiler.timed('worker.batch'):
+                needs_update = False
+                error = None
+                for request in requests:
+                    if request is None:
+                        stopping = True
+                        continue
+                    (function, args, update) = request
+                    try:
+                        function(*args)
+                    except Exception as e:
+                        traceback.print_exc()
+                        error = e
+                    needs_update = needs_update or update
+                    num_done += 1
+
+                candidates = []
+                num_candidates = 0
+                try:
+                    if needs_update:
+                        self.ranker.update()
+                    candidates = self.ranker.peek_candidates(self.prefetch)
+                    num_candidates = self.ranker.num_candidates()
+                except Exception as e:
+                    traceback.print_exc()
+                    error = e
+                self.results.put((num_done, candidates, num_candidates, error))
+
+
+    def poll(self):
+        # the latest result, or None
+        result = None
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return result
+
+
+    def stop(self):
+        # after everything submitted so far has been applied
+        self.requests.put(None)
+        self.thread.join()
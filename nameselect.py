@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import collections
+import constraints
+import nameranker
+import profiling
+import tkinter
+
+
+class NameSelectControllerBase(object):
+
+    # What the windows of picknames.py and picknames2.py share: the votes,
+    # undo and redo, the candidate shown and the ranking worker they are
+    # sent to.  A subclass builds the window with num_candidates_label,
+    # candidate_label, selected_slb and the four buttons, and loads the
+    # ranker in load_state(), load_ranker() and reload_ranker().
+
+    SELECTED_WORDS_FILE_NAME = nameranker.SELECTED_WORDS_FILE_NAME
+    SELECTED_NAMES_FILE_NAME = nameranker.SELECTED_NAMES_FILE_NAME
+    REFUSED_NAMES_FILE_NAME = nameranker.REFUSED_NAMES_FILE_NAME
+    VOTE_JOURNAL_FILE_NAME = nameranker.VOTE_JOURNAL_FILE_NAME
+    CONSTRAINTS_FILE_NAME = constraints.CONSTRAINTS_FILE_NAME
+    POLL_INTERVAL = 20  # ms between looks at the ranking worker
+    WATCH_INTERVAL = 1000   # ms between looks at the files
+
+
+    def reset_state(self):
+        self.ranker.reset_state()
+        self.candidate_name = None  # (w1, w2), or as many words as the name has
+        self.candidates = []    # (name, score), best first, prefetched by the worker
+        self.voted_names = set()    # voted on, not ranked by the worker yet
+        self.selected_names = set() # the ranker's, as far as this window knows
+        self.loaded_selected_names = None   # set by load_ranker() and reload_ranker() for poll_ranking()
+        self.reloaded_votes = False # set by reload_ranker() when votes changed
+        self.ranker_loaded = False  # set by load_ranker() once it got through
+        # the ranker's vote_deltas and undone_votes, as (name, selected)
+        self.undo_votes = collections.deque(maxlen=nameranker.NameRanker.UNDO_LIMIT)
+        self.redo_votes = []
+
+
+    def watch_files(self):
+        # a file caught half written by a program not swapping it in is
+        # read again once it is written to the end
+        try:
+            changed = self.watcher.changed()
+            if changed and self.worker:
+                self.reload_state(changed)
+        except Exception as e:
+            self.num_candidates_label.config(text='錯誤：%s' % e)
+        finally:
+            self.frame.after(self.WATCH_INTERVAL, self.watch_files)
+
+
+    def save_ranker(self):
+        # on the worker thread; the journal holds every vote, this only
+        # makes sure it is on disk
+        self.ranker.save_votes(self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME)
+
+
+    def stop_worker(self):
+        if self.worker:
+            self.worker.stop()
+        self.worker = None
+
+
+    def close_state(self):
+        # the cache is written once here, not on every save
+        self.stop_worker()
+        state = None
+        if self.cache and self.ranker_loaded:
+            state = self.ranker.get_loaded_state()
+        self.ranker.close()
+        if state:
+            self.cache.save(self.cache_key(), state)
+        if self.store:
+            self.store.close()
+
+
+    def poll_ranking(self):
+        result = None
+        if self.worker:
+            result = self.worker.poll()
+
+        if result:
+            (serial, candidates, num_candidates, error) = result
+            self.candidates = candidates
+            if error:
+                # until the next change goes through
+                self.num_candidates_label.config(text='錯誤：%s' % error)
+            else:
+                self.num_candidates_label.config(text=num_candidates)
+            # once every vote is ranked, show the best candidate of the new ranking
+            if serial == self.worker.num_submitted:
+                self.voted_names = set()
+                self.update_current_candidate_name()
+            elif not self.candidate_name:
+                self.update_current_candidate_name()
+
+            # the first result after load_ranker(), or after reload_ranker() changed votes
+            if self.loaded_selected_names is not None:
+                self.selected_names = self.loaded_selected_names
+                self.loaded_selected_names = None
+                self.update_selected_names_view()
+                if self.reloaded_votes:
+                    # the ranker has no votes to undo left
+                    self.reloaded_votes = False
+                    self.undo_votes.clear()
+                    self.redo_votes = []
+                    self.update_undo_buttons()
+                else:
+                    profiling.mark_ready(self.frame, 'first_candidate')
+
+        self.frame.after(self.POLL_INTERVAL, self.poll_ranking)
+
+
+    def update_current_candidate_name(self):
+        # the best prefetched candidate not voted on yet
+        candidate = None
+        for (name, score) in self.candidates:
+            if name not in self.voted_names:
+                candidate = (name, score)
+                break
+
+        if candidate:
+            (name, score) = candidate
+            self.candidate_name = name
+            self.candidate_label.config(text=''.join(name))
+            self.select_button.config(state=tkinter.NORMAL)
+            self.refuse_button.config(state=tkinter.ACTIVE)
+        else:
+            self.candidate_name = None
+            self.candidate_label.config(text='')
+            self.select_button.config(state=tkinter.DISABLED)
+            self.refuse_button.config(state=tkinter.DISABLED)
+
+
+    def select_current_candidate_name(self):
+        name = self.candidate_name
+        self.selected_names.add(name)
+        self.update_selected_names_view()
+        self.vote(name, True)
+
+
+    def update_selected_names_view(self):
+        names = sorted([''.join(name) for name in self.selected_names])
+        self.selected_slb.setlist(names)
+
+
+    def refuse_current_candidate_name(self):
+        name = self.candidate_name
+        #names = [''.join(name) for name in self.ranker.refused_names]
+        #self.refused_slb.setlist(names)
+        self.vote(name, False)
+
+
+    def vote(self, name, selected):
+        # the next prefetched candidate shows at once, the worker re-ranks meanwhile
+        self.voted_names.add(name)
+        if self.profile_vote_file_name:
+            profiling.profiler.profile_next(self.profile_vote_file_name)
+            self.profile_vote_file_name = None
+        self.worker.submit(self.ranker.record_vote, (name, selected))
+        self.undo_votes.append((name, selected))
+        self.redo_votes = []
+        self.update_current_candidate_name()
+        self.update_undo_buttons()
+
+
+    def undo_vote(self):
+        # the name comes back once the worker has re-ranked
+        (name, selected) = self.undo_votes.pop()
+        self.redo_votes.append((name, selected))
+        if selected:
+            self.selected_names.discard(name)
+            self.update_selected_names_view()
+        self.voted_names.discard(name)
+        self.worker.submit(self.ranker.undo_vote)
+        self.update_undo_buttons()
+
+
+    def redo_vote(self):
+        (name, selected) = self.redo_votes.pop()
+        self.undo_votes.append((name, selected))
+        if selected:
+            self.selected_names.add(name)
+            self.update_selected_names_view()
+        self.voted_names.add(name)
+        self.worker.submit(self.ranker.redo_vote)
+        self.update_current_candidate_name()
+        self.update_undo_buttons()
+
+
+    def update_undo_buttons(self):
+        self.undo_button.config(state=tkinter.NORMAL if self.undo_votes else tkinter.DISABLED)
+        self.redo_button.config(state=tkinter.NORMAL if self.redo_votes else tkinter.DISABLED)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+import traceback
+import urllib.parse
+
+import nameranker
+import statestore
+
+
+# picknames.py for several reviewers at once: one NameRanker behind a small
+# HTTP server on localhost.  Every reviewer gets their own queue of
+# candidates, no name is handed to two reviewers at the same time, and
+# everybody's votes go into the same ranking.
+#
+#   GET  /                              the voting page
+#   GET  /candidate?reviewer=NAME       {"name", "score"}, or {"name": null}
+#   POST /vote  {"reviewer", "name", "selected"}
+#   GET  /stats
+#
+# Votes are queued and answered at once; a single task records them and
+# re-ranks once per batch, so nothing needs a lock.  The re-rank runs on the
+# event loop, so no request is answered while it runs; that is on purpose,
+# the ranker is only ever touched from one thread.  A batch that fails is
+# logged and counted in /stats, and the next batch goes on.
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>取名字</title>
+<style>
+body { font-family: Verdana, sans-serif; text-align: center; }
+#name { font-size: 64px; margin: 32px; }
+button { font-size: 32px; margin: 8px; width: 96px; }
+</style>
+</head>
+<body>
+<p>我是 <input id="reviewer"></p>
+<div id="name"></div>
+<button id="select" onclick="vote(true)">✔</button>
+<button id="refuse" onclick="vote(false)">✖</button>
+<script>
+var reviewer = document.getElementById('reviewer');
+reviewer.value = localStorage.getItem('reviewer') || '';
+reviewer.onchange = function() { localStorage.setItem('reviewer', reviewer.value); next(); };
+var current = null;   // not name, that is window.name, always a string
+
+function next() {
+    fetch('/candidate?reviewer=' + encodeURIComponent(reviewer.value))
+        .then(function(response) { return response.json(); })
+        .then(function(candidate) {
+            current = candidate.name;
+            document.getElementById('name').textContent = current || '沒有了';
+        });
+}
+
+function vote(selected) {
+    if (!current)
+        return;
+    fetch('/vote', {method: 'POST', body: JSON.stringify({reviewer: reviewer.value, name: current, selected: selected})})
+        .then(next);
+}
+
+next();
+</script>
+</body>
+</html>
+'''
+
+STATUS_TEXTS = {
+    200: 'OK',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+}
+
+
+class Reviewer(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.queue = collections.deque()  # (name, score), prefetched
+        self.current = None # (name, score), shown and not voted on yet
+        self.last_seen = time.monotonic()
+
+
+class VotingServer(object):
+
+    PREFETCH = 2
+    REVIEWER_TIMEOUT = 300.0    # seconds before an idle reviewer's names go to others
+
+
+    def __init__(self, ranker, name_lengths=(2,)):
+        self.ranker = ranker
+        self.name_lengths = name_lengths    # numbers of words of the names voted on
+        self.reviewers = {}
+        self.leased_names = set()   # in some reviewer's queue or on their screen
+        self.pending_names = set()  # voted on, not recorded yet
+        self.votes = asyncio.Queue()
+        self.num_votes = 0
+        self.num_updates = 0
+        self.num_errors = 0 # batches of votes that raised
+
+
+    def get_reviewer(self, name):
+        if name not in self.reviewers:
+            self.reviewers[name] = Reviewer(name)
+        reviewer = self.reviewers[name]
+        reviewer.last_seen = time.monotonic()
+        return reviewer
+
+
+    def expire_reviewers(self):
+        now = time.monotonic()
+        for reviewer in list(self.reviewers.values()):
+            if now - reviewer.last_seen > self.REVIEWER_TIMEOUT:
+                self.release_queue(reviewer)
+                if reviewer.current:
+                    self.leased_names.discard(reviewer.current[0])
+                del self.reviewers[reviewer.name]
+
+
+    def release_queue(self, reviewer):
+        for candidate in reviewer.queue:
+            self.leased_names.discard(candidate[0])
+        reviewer.queue.clear()
+
+
+    def fill_queue(self, reviewer):
+        while len(reviewer.queue) < self.PREFETCH:
+            candidate = self.ranker.next_candidate()
+            if candidate is None:
+                break
+
+            name = candidate[0]
+            if name in self.leased_names or name in self.pending_names:
+                continue
+            self.leased_names.add(name)
+            reviewer.queue.append(candidate)
+
+
+    def get_candidate(self, reviewer_name):
+        reviewer = self.get_reviewer(reviewer_name)
+        if not reviewer.current:
+            self.fill_queue(reviewer)
+            if reviewer.queue:
+                reviewer.current = reviewer.queue.popleft()
+        return reviewer.current
+
+
+    def submit_vote(self, reviewer_name, name, selected):
+        # answered at once, ingest_votes() records it
+        reviewer = self.get_reviewer(reviewer_name)
+        if reviewer.current and reviewer.current[0] == name:
+            reviewer.current = None
+        self.leased_names.discard(name)
+        self.pending_names.add(name)
+        self.votes.put_nowait((name, selected))
+
+
+    async def ingest_votes(self):
+        while True:
+            votes = [await self.votes.get()]
+            # let every connection that has a vote ready queue it first
+            await asyncio.sleep(0)
+            while not self.votes.empty():
+                votes.append(self.votes.get_nowait())
+
+            for (name, selected) in votes:
+                self.pending_names.discard(name)
+            try:
+                for (name, selected) in votes:
+                    if (selected and name in self.ranker.selected_names) or (not selected and name in self.ranker.refused_names):
+                        continue
+                    self.ranker.record_vote(name, selected)
+                self.num_votes += len(votes)
+
+                # queued candidates were ranked before these votes
+                self.ranker.update()
+                self.num_updates += 1
+            except Exception:
+                traceback.print_exc()
+                self.num_errors += 1
+            for reviewer in self.reviewers.values():
+                self.release_queue(reviewer)
+            self.expire_reviewers()
+
+
+    def get_stats(self):
+        return {
+            'reviewers': len(self.reviewers),
+            'candidates': self.ranker.num_candidates(),
+            'selected': len(self.ranker.selected_names),
+            'refused': len(self.ranker.refused_names),
+            'votes': self.num_votes,
+            'updates': self.num_updates,
+            'errors': self.num_errors,
+        }
+
+
+    def dispatch(self, method, target, body):
+        # (status, content type, content)
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+
+        if method == 'GET' and url.path == '/':
+            return (200, 'text/html; charset=utf-8', PAGE.encode('utf-8'))
+
+        if method == 'GET' and url.path == '/candidate':
+            reviewer_name = query.get('reviewer', [''])[0]
+            candidate = self.get_candidate(reviewer_name)
+            if candidate:
+                (name, score) = candidate
+                return json_response(200, {'name': ''.join(name), 'score': score})
+            return json_response(200, {'name': None})
+
+        if method == 'POST' and url.path == '/vote':
+            try:
+                vote = json.loads(body.decode('utf-8'))
+                name = vote['name']
+                selected = bool(vote['selected'])
+                reviewer_name = str(vote.get('reviewer', ''))
+            except (ValueError, KeyError, TypeError):
+                return json_response(400, {'error': 'expected {"reviewer", "name", "selected"}'})
+            # only names the ranker could have offered go in the journal
+            if not isinstance(name, str) or len(name) not in self.name_lengths:
+                return json_response(400, {'error': 'a name is %s words' % ' or '.join(str(length) for length in self.name_lengths)})
+            if any(w not in self.ranker.word_ids for w in name):
+                return json_response(400, {'error': 'a name is of the selected words'})
+            self.submit_vote(reviewer_name, tuple(name), selected)
+            return json_response(202, {})
+
+        if method == 'GET' and url.path == '/stats':
+            return json_response(200, self.get_stats())
+
+        return json_response(404, {'error': 'not found'})
+
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive, enough for a browser and for review()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                (method, target, version) = request_line.decode('latin-1').split()
+
+                headers = await read_headers(reader)
+                body = b''
+                if 'content-length' in headers:
+                    body = await reader.readexactly(int(headers['content-length']))
+
+                (status, content_type, content) = self.dispatch(method, target, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n'
+                              % (status, STATUS_TEXTS[status], content_type, len(content), 'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+                writer.write(content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def start(self, host='127.0.0.1', port=8000):
+        self.ingest_task = asyncio.ensure_future(self.ingest_votes())
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.ingest_task.cancel()
+
+
+def json_response(status, content):
+    return (status, 'application/json', json.dumps(content, ensure_ascii=False).encode('utf-8'))
+
+
+async def read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        (name, value) = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+
+
+async def request(reader, writer, method, target, content=None):
+    # one request on a keep-alive connection, returns the decoded JSON
+    body = b''
+    if content is not None:
+        body = json.dumps(content, ensure_ascii=False).encode('utf-8')
+    writer.write(('%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n' % (method, target, len(body))).encode('latin-1'))
+    writer.write(body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    headers = await read_headers(reader)
+    body = await reader.readexactly(int(headers['content-length']))
+    return json.loads(body.decode('utf-8'))
+
+
+async def review(host, port, reviewer, num_votes, latencies):
+    # a reviewer refusing num_votes candidates, appending the seconds each vote and next candidate took
+    (reader, writer) = await asyncio.open_connection(host, port)
+    target = '/candidate?reviewer=' + urllib.parse.quote(reviewer)
+    candidate = await request(reader, writer, 'GET', target)
+    for i in range(num_votes):
+        if not candidate['name']:
+            break
+        start = time.perf_counter()
+        await request(reader, writer, 'POST', '/vote', {'reviewer': reviewer, 'name': candidate['name'], 'selected': False})
+        candidate = await request(reader, writer, 'GET', target)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def serve(ranker, host, port, name_lengths=(2,)):
+    server = VotingServer(ranker, name_lengths)
+    await server.start(host, port)
+    print('http://%s:%d/' % (host, port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='取名字, for several reviewers at once')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--numpy', action='store_true', help='score candidates with NumPy')
+    parser.add_argument('--top-k', type=int, default=nameranker.NameRanker.TOP_K, help='number of candidates ranked at a time')
+    parser.add_argument('--db', help='keep the votes in this state database')
+    parser.add_argument('--lengths', type=int, nargs='+', choices=range(1, nameranker.MAX_NAME_LENGTH + 1), default=[2], help='numbers of words of the names offered')
+    args = parser.parse_args()
+
+    backend_class = nameranker.PythonBackend
+    if args.numpy:
+        if not nameranker.import_numpy():
+            parser.error('numpy is not installed')
+        backend_class = nameranker.NumpyBackend
+
+    store = None
+    if args.db:
+        store = statestore.StateStore(args.db)
+
+    (ranker, selected_spelling_sound_words_mapping) = nameranker.load_ranker('picknames', backend_class, args.top_k, store, args.lengths)
+    ranker.update()
+    try:
+        asyncio.run(serve(ranker, args.host, args.port, args.lengths))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ranker.close()
+        if store:
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,28 @@
 #!/usr/bin/env python3
 
-import csv
-import os
-import pickle
+import argparse
+import functools
+import nameranker
+import nameselect
 import Pmw
+import profiling
+import rankcache
+import statestore
 import tkinter
 
 
-class NameSelectController(object):
+class NameSelectController(nameselect.NameSelectControllerBase):
 
-    SELECTED_WORDS_FILE_NAME = 'words-selected.pkl'
-    SELECTED_NAMES_FILE_NAME = 'names-selected.txt'
-    REFUSED_NAMES_FILE_NAME = 'names-refused.txt'
-
-
-    def __init__(self, parent_view):
+    def __init__(self, parent_view, backend_class=nameranker.PythonBackend, prefetch=nameranker.RankingWorker.PREFETCH, store=None, name_lengths=(2,), cache=None, watch=False):
+        self.ranker = nameranker.NameRanker(backend_class)
+        self.prefetch = prefetch    # candidates the worker ranks ahead, --top-k
+        self.store = store  # a statestore.StateStore instead of the files
+        self.name_lengths = name_lengths    # numbers of words of the names offered
+        self.cache = None if store else cache   # a rankcache.RankingCache of the loaded ranker
+        self.watch = watch and not store    # reload the files written by other programs
+        self.watcher = None # a nameranker.FileWatcher of the files loaded
+        self.worker = None  # re-ranks after votes, off the Tk thread
+        self.profile_vote_file_name = None  # cProfile the re-rank after the next vote into this file
         self.reset_state()
 
         self.frame = tkinter.Frame(parent_view)
@@ -39,183 +47,112 @@ class NameSelectController(object):
         choice_bb.pack(side=tkinter.LEFT, fill=tkinter.BOTH, expand=True)
         self.select_button = choice_bb.add('✔', state=tkinter.DISABLED, command=self.select_current_candidate_name)
         self.refuse_button = choice_bb.add( '✖', state=tkinter.DISABLED, command=self.refuse_current_candidate_name)
+        self.undo_button = choice_bb.add('復原', state=tkinter.DISABLED, command=self.undo_vote)
+        self.redo_button = choice_bb.add('重做', state=tkinter.DISABLED, command=self.redo_vote)
 
         # restore state
         self.load_state()
+        self.frame.after(self.POLL_INTERVAL, self.poll_ranking)
+        if self.watch:
+            self.frame.after(self.WATCH_INTERVAL, self.watch_files)
 
 
-    def reset_state(self):
-        self.candidate_words = set()
-        self.word1_selected_count = {}
-        self.word2_selected_count = {}
-        self.word1_refused_count = {}
-        self.word2_refused_count = {}
-        self.refused_names = set()  # (w1, w2)
-        self.selected_names = set() # (w1, w2)
+    @profiling.timed_calls('picknames.reload_state')
+    def reload_state(self, file_names=None):
+        # what changed in file_names, all of them by default, as deltas to
+        # the ranker instead of loading it again
+        if file_names is None:
+            self.watcher.changed()
+            file_names = self.watched_file_names()
 
-        self.candidate_names_with_score = []   # (w1, w2, score)
-        self.candidate_name = None  # (w,1 w2)
+        selected_spelling_sound_words_mapping = None
+        if self.SELECTED_WORDS_FILE_NAME in file_names or self.CONSTRAINTS_FILE_NAME in file_names:
+            selected_spelling_sound_words_mapping = self.load_selected_words()
+        reload_votes = self.SELECTED_NAMES_FILE_NAME in file_names or self.REFUSED_NAMES_FILE_NAME in file_names
+        self.worker.submit(self.reload_ranker, (selected_spelling_sound_words_mapping, reload_votes))
 
 
-    def reload_state(self):
-        self.reset_state()
-        self.load_state()
+    def watched_file_names(self):
+        # what load_ranker_files() reads, but the journal this window writes
+        return [self.SELECTED_WORDS_FILE_NAME, self.CONSTRAINTS_FILE_NAME, self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME]
 
 
     def load_state(self):
-        selected_spelling_sound_words_mapping = {}
-        if os.path.exists(self.SELECTED_WORDS_FILE_NAME):
-            with open(self.SELECTED_WORDS_FILE_NAME, 'rb') as f:
-                selected_spelling_sound_words_mapping = pickle.load(f)
-        #print('LOAD:', selected_spelling_sound_words_mapping)
+        # the window is up while the worker loads the ranker
+        self.num_candidates_label.config(text='載入中')
+        self.watcher = nameranker.FileWatcher(self.watched_file_names())
+        self.worker = nameranker.RankingWorker(self.ranker, self.prefetch)
+        self.worker.submit(self.load_ranker)
+        self.update_undo_buttons()
+
+
+    @profiling.timed_calls('picknames.load_ranker')
+    def load_ranker(self):
+        # on the worker thread, which re-ranks right after
+        state = None
+        if self.cache:
+            state = self.cache.load(self.cache_key())
+        if state:
+            self.ranker.set_loaded_state(state, self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME, self.VOTE_JOURNAL_FILE_NAME)
+        else:
+            self.load_ranker_files()
+        self.loaded_selected_names = set(self.ranker.selected_names)
+        self.ranker_loaded = True
+
+
+    def load_ranker_files(self):
+        nameranker.load_candidate_names(self.ranker, self.load_selected_words(), self.name_lengths, constraints_file_name=self.CONSTRAINTS_FILE_NAME)
+        self.ranker.load_votes(self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME, self.VOTE_JOURNAL_FILE_NAME, store=self.store)
+        if self.cache:
+            self.cache.save(self.cache_key(), self.ranker.get_loaded_state())
 
-        for spelling in selected_spelling_sound_words_mapping:
-            for sound, words in selected_spelling_sound_words_mapping[spelling].items():
-                self.candidate_words.update(words)
-
-        if os.path.exists(self.SELECTED_NAMES_FILE_NAME):
-            with open(self.SELECTED_NAMES_FILE_NAME, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    w1 = line[0]
-                    w2 = line[1]
-                    self.add_selected_name(w1, w2)
-                #print('LOAD selected_names:', self.selected_names)
-
-        if os.path.exists(self.REFUSED_NAMES_FILE_NAME):
-            with open(self.REFUSED_NAMES_FILE_NAME, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    w1 = line[0]
-                    w2 = line[1]
-                    self.add_refused_name(w1, w2)
-                #print('LOAD refused_names:', self.refused_names)
-
-        self.update_selected_names_view()
-
-        #names = [w1 + w2 for (w1, w2) in self.refused_names]
+        #names = [''.join(name) for name in self.ranker.refused_names]
         #self.refused_slb.setlist(names)
 
-        self.update_candidate_names_with_score()
 
+    @profiling.timed_calls('picknames.reload_ranker')
+    def reload_ranker(self, selected_spelling_sound_words_mapping, reload_votes):
+        # on the worker thread: the new words join the vocabulary, the names
+        # are those of the words selected now and the votes saved since are
+        # counted
+        if not self.ranker_loaded:
+            # whatever made loading fail may be fixed now
+            self.ranker.reset_state()
+            self.load_ranker()
+            return
 
-    def save_state(self):
-        with open(self.SELECTED_NAMES_FILE_NAME, 'w', encoding='utf-8') as f:
-            names = sorted([w1 + w2 for (w1, w2) in self.selected_names])
-            for name in names:
-                f.write(name + '\n')
-
-        with open(self.REFUSED_NAMES_FILE_NAME, 'w', encoding='utf-8') as f:
-            names = sorted([w1 + w2 for (w1, w2) in self.refused_names])
-            for name in names:
-                f.write(name + '\n')
-
-
-    def add_selected_name(self, w1, w2):
-        self.selected_count_sanity_check(w1, w2)
-        self.word1_selected_count[w1] += 1
-        self.word2_selected_count[w2] += 1
-        self.selected_names.add((w1, w2))
-
-
-    def add_refused_name(self, w1, w2):
-        self.refused_count_sanity_check(w1, w2)
-        self.word1_refused_count[w1] += 1
-        self.word2_refused_count[w2] += 1
-        self.refused_names.add((w1, w2))
-
-
-    def selected_count_sanity_check(self, w1, w2):
-        if w1 not in self.word1_selected_count:
-            self.word1_selected_count[w1] = 0
-        if w2 not in self.word2_selected_count:
-            self.word2_selected_count[w2] = 0
-
-
-    def refused_count_sanity_check(self, w1, w2):
-        if w1 not in self.word1_refused_count:
-            self.word1_refused_count[w1] = 0
-        if w2 not in self.word2_refused_count:
-            self.word2_refused_count[w2] = 0
-
-
-    def score_name(self, w1, w2):
-        self.selected_count_sanity_check(w1, w2)
-        self.refused_count_sanity_check(w1, w2)
-
-        if not self.selected_names and w1 == w2:
-            return -1.0
-
-        score = 0
-        if self.selected_names:
-            score += float(self.word1_selected_count[w1]) / len(self.selected_names)
-            score += float(self.word2_selected_count[w2]) / len(self.selected_names)
-        if self.refused_names:
-            score -= float(self.word1_refused_count[w1]) / len(self.refused_names)
-            score -= float(self.word2_refused_count[w2]) / len(self.refused_names)
-        return score
-
-
-    def update_candidate_names_with_score(self):
-        names = []
-        for w1 in self.candidate_words:
-            for w2 in self.candidate_words:
-                if (w1, w2) in self.refused_names or (w1, w2) in self.selected_names:
-                    continue
-                score = self.score_name(w1, w2)
-                names.append((w1, w2, score))
-        self.candidate_names_with_score = sorted(names, key=lambda tup: tup[2])
-        #print(self.candidate_names_with_score)
-        self.num_candidates_label.config(text=len(self.candidate_names_with_score))
-        self.update_current_candidate_name()
-
-
-    def update_current_candidate_name(self):
-        if self.candidate_names_with_score:
-            (w1, w2, score) = self.candidate_names_with_score.pop()
-            self.candidate_name = (w1, w2)
-            name = w1 + w2
-            self.candidate_label.config(text=name)
-            self.select_button.config(state=tkinter.NORMAL)
-            self.refuse_button.config(state=tkinter.ACTIVE)
-        else:
-            self.candidate_name = None
-            self.candidate_label.config(text='')
-            self.select_button.config(state=tkinter.DISABLED)
-            self.refuse_button.config(state=tkinter.DISABLED)
+        nameranker.load_candidate_names(self.ranker, selected_spelling_sound_words_mapping, self.name_lengths, constraints_file_name=self.CONSTRAINTS_FILE_NAME)
 
+        if reload_votes and self.ranker.reload_votes():
+            self.reloaded_votes = True
+            self.loaded_selected_names = set(self.ranker.selected_names)
 
-    def select_current_candidate_name(self):
-        (w1, w2) = self.candidate_name
-        self.add_selected_name(w1, w2)
-        self.update_selected_names_view()
-        #self.update_current_candidate_name()
-        self.update_candidate_names_with_score()
+
+    def load_selected_words(self):
+        if self.store:
+            selected_spelling_sound_words_mapping = self.store.load_selected_words()
+        else:
+            selected_spelling_sound_words_mapping = nameranker.load_selected_words(self.SELECTED_WORDS_FILE_NAME)
+        #print('LOAD:', selected_spelling_sound_words_mapping)
+        return selected_spelling_sound_words_mapping
 
 
-    def update_selected_names_view(self):
-        names = sorted([w1 + w2 for (w1, w2) in self.selected_names])
-        self.selected_slb.setlist(names)
+    def cache_key(self):
+        # the files load_ranker_files() reads
+        file_names = [self.SELECTED_WORDS_FILE_NAME, self.CONSTRAINTS_FILE_NAME, self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME, self.VOTE_JOURNAL_FILE_NAME]
+        return rankcache.fingerprint(file_names, 'picknames', tuple(self.name_lengths))
 
 
-    def refuse_current_candidate_name(self):
-        (w1, w2) = self.candidate_name
-        self.add_refused_name(w1, w2)
-        #names = [w1 + w2 for (w1, w2) in self.refused_names]
-        #self.refused_slb.setlist(names)
-        #self.update_current_candidate_name()
-        self.update_candidate_names_with_score()
+    @profiling.timed_calls('picknames.save_state')
+    def save_state(self):
+        self.worker.submit(self.save_ranker, update=False)
 
 
 class App(object):
-    def __init__(self, root):
+    def __init__(self, root, backend_class=nameranker.PythonBackend, prefetch=nameranker.RankingWorker.PREFETCH, store=None, name_lengths=(2,), cache=None, watch=False):
         self.root = root
 
-        self.nsc = NameSelectController(root)
+        self.nsc = NameSelectController(root, backend_class, prefetch, store, name_lengths, cache, watch)
 
         self.button = tkinter.Button(root, text='離開', fg="red", command=self.quit)
         self.button.pack(side=tkinter.RIGHT)
@@ -236,10 +173,12 @@ class App(object):
 
     def save_and_quit(self):
         self.nsc.save_state()
+        self.nsc.close_state()
         self.root.quit()
 
 
     def quit(self):
+        self.nsc.close_state()
         self.root.quit()
 
 
@@ -248,11 +187,46 @@ class App(object):
 
 
 def main():
+    parser = argparse.ArgumentParser(description='取名字')
+    parser.add_argument('--numpy', action='store_true', help='score candidates with NumPy')
+    parser.add_argument('--processes', type=int, help='score candidates with NumPy in this many processes')
+    parser.add_argument('--top-k', type=int, default=nameranker.RankingWorker.PREFETCH, help='number of candidates ranked ahead after each vote')
+    parser.add_argument('--db', help='keep the selected words, spelling pairs and votes in this state database')
+    parser.add_argument('--lengths', type=int, nargs='+', choices=range(1, nameranker.MAX_NAME_LENGTH + 1), default=[2], help='numbers of words of the names offered')
+    parser.add_argument('--no-cache', action='store_true', help='always load the ranking from the files, never from ' + rankcache.CACHE_DIRECTORY)
+    parser.add_argument('--no-watch', action='store_true', help='only reload the files when asked to, not as soon as another program writes them')
+    profiling.add_arguments(parser)
+    parser.add_argument('--profile-vote', metavar='PROFILE_FILE', help='write a cProfile of the re-rank after the first vote to this file')
+    args = parser.parse_args()
+    profiling.enable_from_arguments(args)
+
+    backend_class = nameranker.PythonBackend
+    if args.numpy:
+        if not nameranker.import_numpy():
+            parser.error('numpy is not installed')
+        backend_class = nameranker.NumpyBackend
+    if args.processes:
+        if not nameranker.import_numpy():
+            parser.error('numpy is not installed')
+        backend_class = functools.partial(nameranker.ProcessPoolBackend, max_workers=args.processes)
+
+    store = None
+    if args.db:
+        store = statestore.StateStore(args.db)
+
     root = tkinter.Tk()
     root.option_readfile('.picknames.tkinter.options')
     root.wm_title('取名字')
     Pmw.initialise()
-    app = App(root)
+    cache = None
+    if not args.no_cache:
+        cache = rankcache.RankingCache()
+
+    app = App(root, backend_class, args.top_k, store, args.lengths, cache, not args.no_watch)
+    root.after_idle(profiling.mark_ready, root, 'first_frame')
+    app.nsc.profile_vote_file_name = args.profile_vote
+    if args.stats:
+        profiling.StatsPanel(root, profiling.profiler)
     root.mainloop()
 
 
@@ -1,71 +1,150 @@
 #!/usr/bin/env python3
 
-import csv
-import os
-import pickle
+import argparse
+import nameranker
+import nameselect
 import Pmw
+import profiling
+import rankcache
+import statestore
 import tkinter
+import tkinter.font
 
 
-class SpellingPairController(object):
+class SpellingPairGrid(object):
 
-    def __init__(self, parent_view, delegate, row, column, spelling1, words1, spelling2, words2):
+    # every (spelling1, spelling2) pair as a cell of a single canvas, instead
+    # of a Button per pair; cell (i, j) is selected[i * n + j]
+
+    __slots__ = ('delegate', 'spellings', 'spelling_words', 'num_spellings', 'selected', 'canvas', 'font', 'cell_width', 'cell_height', 'cell_items')
+
+    PADDING = 4
+
+
+    @profiling.timed_calls('picknames2.build_grid')
+    def __init__(self, parent_view, delegate, spellings, spelling_words):
         self.delegate = delegate
-        self.spelling1 = spelling1
-        self.spelling2 = spelling2
-        self.selected = False
+        self.spellings = spellings
+        self.spelling_words = spelling_words  # the words of spellings[i]
+        self.num_spellings = len(spellings)
+        self.selected = bytearray(self.num_spellings * self.num_spellings)
+
+        self.canvas = tkinter.Canvas(parent_view, highlightthickness=0)
+        self.canvas.pack(side=tkinter.TOP, anchor=tkinter.NW)
+        self.canvas.bind('<Button-1>', self.click)
+
+        self.font = tkinter.font.Font(root=self.canvas, font=self.canvas.option_get('font', 'Font') or 'TkDefaultFont')
+        labels = ["%s-%s" % (spelling.capitalize(), spelling.capitalize()) for spelling in spellings]
+        self.cell_width = max([self.font.measure(label) for label in labels] + [0]) + 2 * self.PADDING
+        self.cell_height = self.font.metrics('linespace') + 2 * self.PADDING
+        self.canvas.config(width=self.num_spellings * self.cell_width, height=self.num_spellings * self.cell_height)
+
+        self.cell_items = []  # (rectangle, text) of each cell
+        for i, spelling1 in enumerate(spellings):
+            y = i * self.cell_height
+            for j, spelling2 in enumerate(spellings):
+                x = j * self.cell_width
+                displayed_text = "%s-%s" % (spelling1.capitalize(), spelling2.capitalize())
+                rectangle = self.canvas.create_rectangle(x + 1, y + 1, x + self.cell_width - 1, y + self.cell_height - 1, fill='', outline='gray70')
+                text = self.canvas.create_text(x + self.cell_width // 2, y + self.cell_height // 2, text=displayed_text, font=self.font)
+                self.cell_items.append((rectangle, text))
+
+
+    def get_spelling_pair(self, i, j):
+        return (self.spellings[i], self.spellings[j])
+
 
-        self.word_pairs = []
-        for w1 in words1:
-            for w2 in words2:
-                self.word_pairs.append((w1, w2))
+    def get_words(self, i, j):
+        return (self.spelling_words[i], self.spelling_words[j])
 
-        displayed_text = "%s-%s" % (spelling1.capitalize(), spelling2.capitalize())
 
-        self.button = tkinter.Button(parent_view, text=displayed_text, command=self.toggle_spelling_pair_button)
-        self.button.grid(row=row, column=column, sticky=tkinter.NW+tkinter.SE)
+    def is_selected(self, i, j):
+        return self.selected[i * self.num_spellings + j]
 
 
-    def toggle_spelling_pair_button(self):
-        if self.selected:
-            self.deselect_spelling_pair_button()
+    def click(self, event):
+        i = event.y // self.cell_height
+        j = event.x // self.cell_width
+        if 0 <= i < self.num_spellings and 0 <= j < self.num_spellings:
+            self.toggle_spelling_pair(i, j)
+
+
+    def toggle_spelling_pair(self, i, j):
+        if self.is_selected(i, j):
+            self.deselect_spelling_pair(i, j)
         else:
-            self.select_spelling_pair_button()
+            self.select_spelling_pair(i, j)
 
-        self.delegate.update_candidate_names_with_score()
+        self.delegate.update_spelling_pair(self, i, j)
 
 
-    def select_spelling_pair_button(self):
-        self.selected = True
-        self.button.config(relief=tkinter.SUNKEN, fg="red")
+    def select_spelling_pair(self, i, j):
+        self.selected[i * self.num_spellings + j] = 1
+        (rectangle, text) = self.cell_items[i * self.num_spellings + j]
+        self.canvas.itemconfig(rectangle, fill='gray70', outline='gray40')
+        self.canvas.itemconfig(text, fill='red')
 
 
-    def deselect_spelling_pair_button(self):
-        self.selected = False
-        self.button.config(relief=tkinter.RAISED, fg="black")
+    def deselect_spelling_pair(self, i, j):
+        self.selected[i * self.num_spellings + j] = 0
+        (rectangle, text) = self.cell_items[i * self.num_spellings + j]
+        self.canvas.itemconfig(rectangle, fill='', outline='gray70')
+        self.canvas.itemconfig(text, fill='black')
 
 
-    def get_candidate_names(self):
-        if self.selected:
-            return self.word_pairs
-        else:
-            return None
+    def get_selected_spelling_pairs(self):
+        selected_spelling_pairs = []
+        for k, selected in enumerate(self.selected):
+            if selected:
+                selected_spelling_pairs.append(self.get_spelling_pair(*divmod(k, self.num_spellings)))
+        return selected_spelling_pairs
+
+
+    def get_selected_word_pairs(self):
+        # {(spelling1, spelling2): (words1, words2)} of the selected cells
+        word_pairs = {}
+        for k, selected in enumerate(self.selected):
+            if selected:
+                (i, j) = divmod(k, self.num_spellings)
+                word_pairs[self.get_spelling_pair(i, j)] = self.get_words(i, j)
+        return word_pairs
 
 
+    def select_spelling_pairs(self, spelling_pairs):
+        # these and no other, without telling the delegate
+        spelling_indices = {spelling: i for i, spelling in enumerate(self.spellings)}
+        cells = set()
+        for (spelling1, spelling2) in spelling_pairs:
+            if spelling1 in spelling_indices and spelling2 in spelling_indices:
+                cells.add(spelling_indices[spelling1] * self.num_spellings + spelling_indices[spelling2])
+        for k, selected in enumerate(self.selected):
+            if selected and k not in cells:
+                self.deselect_spelling_pair(*divmod(k, self.num_spellings))
+        for k in cells:
+            if not self.selected[k]:
+                self.select_spelling_pair(*divmod(k, self.num_spellings))
+
+
+    @profiling.timed_calls('picknames2.destroy_grid')
     def destroy(self):
-        self.button.destroy()
+        self.canvas.destroy()
 
 
-class NameSelectController(object):
+class NameSelectController(nameselect.NameSelectControllerBase):
 
-    SPELLINGS_FILE_NAME = '.picknames2.data.pkl'
-    STATE_FILE_NAME = '.picknames2.state.pkl'
-    SELECTED_WORDS_FILE_NAME = 'words-selected.pkl'
-    SELECTED_NAMES_FILE_NAME = 'names-selected.txt'
-    REFUSED_NAMES_FILE_NAME = 'names-refused.txt'
+    SPELLINGS_FILE_NAME = nameranker.SPELLINGS_FILE_NAME
+    STATE_FILE_NAME = nameranker.SELECTED_SPELLING_PAIRS_FILE_NAME
 
 
-    def __init__(self, parent_view):
+    def __init__(self, parent_view, prefetch=nameranker.RankingWorker.PREFETCH, store=None, cache=None, watch=False):
+        self.ranker = nameranker.NameRanker()
+        self.prefetch = prefetch    # candidates the worker ranks ahead, --top-k
+        self.store = store  # a statestore.StateStore instead of the files
+        self.cache = None if store else cache   # a rankcache.RankingCache of the loaded ranker
+        self.watch = watch and not store    # reload the files written by other programs
+        self.watcher = None # a nameranker.FileWatcher of the files loaded
+        self.worker = None  # re-ranks after votes, off the Tk thread
+        self.profile_vote_file_name = None  # cProfile the re-rank after the next vote into this file
         self.reset_state()
 
         self.frame = tkinter.Frame(parent_view)
@@ -99,233 +178,176 @@ class NameSelectController(object):
         choice_bb.pack(side=tkinter.LEFT, fill=tkinter.BOTH, expand=True)
         self.select_button = choice_bb.add('✔', state=tkinter.DISABLED, command=self.select_current_candidate_name)
         self.refuse_button = choice_bb.add( '✖', state=tkinter.DISABLED, command=self.refuse_current_candidate_name)
+        self.undo_button = choice_bb.add('復原', state=tkinter.DISABLED, command=self.undo_vote)
+        self.redo_button = choice_bb.add('重做', state=tkinter.DISABLED, command=self.redo_vote)
 
         # restore state
         self.load_state()
+        self.frame.after(self.POLL_INTERVAL, self.poll_ranking)
+        if self.watch:
+            self.frame.after(self.WATCH_INTERVAL, self.watch_files)
 
 
     def reset_state(self):
-        self.candidate_words = set()
-        self.word1_selected_count = {}
-        self.word2_selected_count = {}
-        self.word1_refused_count = {}
-        self.word2_refused_count = {}
-        self.refused_names = set()  # (w1, w2)
-        self.selected_names = set() # (w1, w2)
+        nameselect.NameSelectControllerBase.reset_state(self)
+        self.spelling_pair_grid = None
+
+
+    @profiling.timed_calls('picknames2.reload_state')
+    def reload_state(self, file_names=None):
+        # what changed in file_names, all of them by default, as deltas to
+        # the grid and the ranker instead of building them again; the pairs
+        # toggled since saving stay unless the pairs file is one of them
+        if file_names is None:
+            self.watcher.changed()
+            file_names = self.watched_file_names()
+
+        selected_spelling_pairs = set(self.spelling_pair_grid.get_selected_spelling_pairs())
+        if self.STATE_FILE_NAME in file_names:
+            selected_spelling_pairs = self.load_selected_spelling_pairs()
+
+        selected_spelling_sound_words_mapping = None
+        if self.SPELLINGS_FILE_NAME in file_names or self.SELECTED_WORDS_FILE_NAME in file_names or self.CONSTRAINTS_FILE_NAME in file_names:
+            (selected_spelling_sound_words_mapping, grid_spellings, spelling_words) = self.load_selected_words()
+            if grid_spellings == self.spelling_pair_grid.spellings:
+                self.spelling_pair_grid.spelling_words[:] = spelling_words
+            else:
+                # the saved pairs of spellings the grid did not have
+                shown_spellings = set(self.spelling_pair_grid.spellings)
+                for (spelling1, spelling2) in self.load_selected_spelling_pairs():
+                    if spelling1 not in shown_spellings or spelling2 not in shown_spellings:
+                        selected_spelling_pairs.add((spelling1, spelling2))
+                self.spelling_pair_grid.destroy()
+                self.spelling_pair_grid = SpellingPairGrid(self.spelling_pairs_sf.interior(), self, grid_spellings, spelling_words)
+        self.spelling_pair_grid.select_spelling_pairs(selected_spelling_pairs)
+
+        reload_votes = self.SELECTED_NAMES_FILE_NAME in file_names or self.REFUSED_NAMES_FILE_NAME in file_names
+        self.worker.submit(self.reload_ranker, (selected_spelling_sound_words_mapping, self.spelling_pair_grid.get_selected_word_pairs(), reload_votes))
+
+
+    def watched_file_names(self):
+        # what load_state() reads, but the journal this window writes
+        return [self.SPELLINGS_FILE_NAME, self.SELECTED_WORDS_FILE_NAME, self.STATE_FILE_NAME, self.CONSTRAINTS_FILE_NAME, self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME]
+
+
+    @profiling.timed_calls('picknames2.load_state')
+    def load_state(self):
+        # the grid is drawn here, the worker loads the ranker meanwhile
+        self.watcher = nameranker.FileWatcher(self.watched_file_names())
+        (selected_spelling_sound_words_mapping, grid_spellings, spelling_words) = self.load_selected_words()
+        self.spelling_pair_grid = SpellingPairGrid(self.spelling_pairs_sf.interior(), self, grid_spellings, spelling_words)
+        self.spelling_pair_grid.select_spelling_pairs(self.load_selected_spelling_pairs())
 
-        self.candidate_names_with_score = []   # (w1, w2, score)
-        self.candidate_name = None  # (w,1 w2)
+        self.num_candidates_label.config(text='載入中')
+        self.worker = nameranker.RankingWorker(self.ranker, self.prefetch)
+        self.worker.submit(self.load_ranker, (selected_spelling_sound_words_mapping, self.spelling_pair_grid.get_selected_word_pairs()))
+        self.update_undo_buttons()
 
-        self.spelling_pair_controllers = []
 
+    def load_selected_words(self):
+        # the selected words, and the spellings of the grid with their words
+        spellings = nameranker.load_spellings(self.SPELLINGS_FILE_NAME)
 
-    def reload_state(self):
-        for spc in self.spelling_pair_controllers:
-            spc.destroy()
+        if self.store:
+            selected_spelling_sound_words_mapping = self.store.load_selected_words()
+        else:
+            selected_spelling_sound_words_mapping = nameranker.load_selected_words(self.SELECTED_WORDS_FILE_NAME)
+        #print('LOAD:', selected_spelling_sound_words_mapping)
 
-        self.reset_state()
-        self.load_state()
+        # every spelling pair shares the word sets of its two spellings
+        grid_spellings = []
+        spelling_words = []
+        for spelling in spellings:
+            if spelling in selected_spelling_sound_words_mapping:
+                grid_spellings.append(spelling)
+                spelling_words.append(nameranker.spelling_words(selected_spelling_sound_words_mapping, spelling))
+        return (selected_spelling_sound_words_mapping, grid_spellings, spelling_words)
+
+
+    def load_selected_spelling_pairs(self):
+        if self.store:
+            return set(self.store.load_selected_spelling_pairs())
+        return set(nameranker.load_selected_spelling_pairs(self.STATE_FILE_NAME))
+
+
+    @profiling.timed_calls('picknames2.load_ranker')
+    def load_ranker(self, selected_spelling_sound_words_mapping, word_pairs):
+        # on the worker thread, before any pair toggled meanwhile
+        state = None
+        if self.cache:
+            state = self.cache.load(self.cache_key())
+        if state:
+            self.ranker.set_loaded_state(state, self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME, self.VOTE_JOURNAL_FILE_NAME)
+            # the pairs file may have been written since the grid read it
+            nameranker.load_candidate_names(self.ranker, None, word_pairs=word_pairs)
+        else:
+            self.load_ranker_files(selected_spelling_sound_words_mapping, word_pairs)
+        self.loaded_selected_names = set(self.ranker.selected_names)
+        self.ranker_loaded = True
 
 
-    def load_state(self):
-        spellings = []
-        if os.path.exists(self.SPELLINGS_FILE_NAME):
-            with open(self.SPELLINGS_FILE_NAME, 'rb') as f:
-                spellings = pickle.load(f)
-
-        selected_spelling_sound_words_mapping = {}
-        if os.path.exists(self.SELECTED_WORDS_FILE_NAME):
-            with open(self.SELECTED_WORDS_FILE_NAME, 'rb') as f:
-                selected_spelling_sound_words_mapping = pickle.load(f)
-        #print('LOAD:', selected_spelling_sound_words_mapping)
+    def load_ranker_files(self, selected_spelling_sound_words_mapping, word_pairs):
+        nameranker.load_candidate_names(self.ranker, selected_spelling_sound_words_mapping, word_pairs=word_pairs, constraints_file_name=self.CONSTRAINTS_FILE_NAME)
+        self.ranker.load_votes(self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME, self.VOTE_JOURNAL_FILE_NAME, store=self.store)
+        if self.cache:
+            self.cache.save(self.cache_key(), self.ranker.get_loaded_state())
 
-        for i, spelling1 in enumerate(spellings):
-            if spelling1 not in selected_spelling_sound_words_mapping:
-                continue
+        #names = [''.join(name) for name in self.ranker.refused_names]
+        #self.refused_slb.setlist(names)
 
-            words1 = set()
-            for sound, words in selected_spelling_sound_words_mapping[spelling1].items():
-                words1.update(words)
 
-            for j, spelling2 in enumerate(spellings):
-                if spelling2 not in selected_spelling_sound_words_mapping:
-                    continue
-
-                words2 = set()
-                for sound, words in selected_spelling_sound_words_mapping[spelling2].items():
-                    words2.update(words)
-
-                #print("pair %d %d: %s, %s" % (i, j, words1, words2))
-                spc = SpellingPairController(self.spelling_pairs_sf.interior(), self, i, j, spelling1, words1, spelling2, words2)
-                self.spelling_pair_controllers.append(spc)
-
-        if os.path.exists(self.STATE_FILE_NAME):
-            with open(self.STATE_FILE_NAME, 'rb') as f:
-                selected_spelling_pairs = pickle.load(f)
-
-            for spc in self.spelling_pair_controllers:
-                pair = (spc.spelling1, spc.spelling2)
-                if pair in selected_spelling_pairs:
-                    spc.select_spelling_pair_button()
-
-        if os.path.exists(self.SELECTED_NAMES_FILE_NAME):
-            with open(self.SELECTED_NAMES_FILE_NAME, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    w1 = line[0]
-                    w2 = line[1]
-                    self.add_selected_name(w1, w2)
-                #print('LOAD selected_names:', self.selected_names)
-
-        if os.path.exists(self.REFUSED_NAMES_FILE_NAME):
-            with open(self.REFUSED_NAMES_FILE_NAME, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    w1 = line[0]
-                    w2 = line[1]
-                    self.add_refused_name(w1, w2)
-                #print('LOAD refused_names:', self.refused_names)
-
-        self.update_selected_names_view()
-
-        #names = [w1 + w2 for (w1, w2) in self.refused_names]
-        #self.refused_slb.setlist(names)
+    @profiling.timed_calls('picknames2.reload_ranker')
+    def reload_ranker(self, selected_spelling_sound_words_mapping, word_pairs, reload_votes):
+        # on the worker thread: the new words join the vocabulary, the pairs
+        # whose words changed are put back and the votes saved since counted
+        if not self.ranker_loaded:
+            # whatever made loading fail may be fixed now
+            if selected_spelling_sound_words_mapping is None:
+                selected_spelling_sound_words_mapping = self.load_selected_words()[0]
+            self.ranker.reset_state()
+            self.load_ranker(selected_spelling_sound_words_mapping, word_pairs)
+            return
 
-        self.update_candidate_names_with_score()
+        nameranker.load_candidate_names(self.ranker, selected_spelling_sound_words_mapping, word_pairs=word_pairs, constraints_file_name=self.CONSTRAINTS_FILE_NAME)
 
+        if reload_votes and self.ranker.reload_votes():
+            self.reloaded_votes = True
+            self.loaded_selected_names = set(self.ranker.selected_names)
 
-    def save_state(self):
-        with open(self.STATE_FILE_NAME, 'wb') as f:
-            selected_spelling_pairs = []
-            for spc in self.spelling_pair_controllers:
-                if not spc.selected:
-                    continue
-                pair = (spc.spelling1, spc.spelling2)
-                selected_spelling_pairs.append(pair)
-
-            pickle.dump(selected_spelling_pairs, f)
-
-        with open(self.SELECTED_NAMES_FILE_NAME, 'w', encoding='utf-8') as f:
-            names = sorted([w1 + w2 for (w1, w2) in self.selected_names])
-            for name in names:
-                f.write(name + '\n')
-
-        with open(self.REFUSED_NAMES_FILE_NAME, 'w', encoding='utf-8') as f:
-            names = sorted([w1 + w2 for (w1, w2) in self.refused_names])
-            for name in names:
-                f.write(name + '\n')
-
-
-    def add_selected_name(self, w1, w2):
-        self.selected_count_sanity_check(w1, w2)
-        self.word1_selected_count[w1] += 1
-        self.word2_selected_count[w2] += 1
-        self.selected_names.add((w1, w2))
-
-
-    def add_refused_name(self, w1, w2):
-        self.refused_count_sanity_check(w1, w2)
-        self.word1_refused_count[w1] += 1
-        self.word2_refused_count[w2] += 1
-        self.refused_names.add((w1, w2))
-
-
-    def selected_count_sanity_check(self, w1, w2):
-        if w1 not in self.word1_selected_count:
-            self.word1_selected_count[w1] = 0
-        if w2 not in self.word2_selected_count:
-            self.word2_selected_count[w2] = 0
-
-
-    def refused_count_sanity_check(self, w1, w2):
-        if w1 not in self.word1_refused_count:
-            self.word1_refused_count[w1] = 0
-        if w2 not in self.word2_refused_count:
-            self.word2_refused_count[w2] = 0
-
-
-    def score_name(self, w1, w2):
-        self.selected_count_sanity_check(w1, w2)
-        self.refused_count_sanity_check(w1, w2)
-
-        if not self.selected_names and w1 == w2:
-            return -1.0
-
-        score = 0
-        if self.selected_names:
-            score += float(self.word1_selected_count[w1]) / len(self.selected_names)
-            score += float(self.word2_selected_count[w2]) / len(self.selected_names)
-        if self.refused_names:
-            score -= float(self.word1_refused_count[w1]) / len(self.refused_names)
-            score -= float(self.word2_refused_count[w2]) / len(self.refused_names)
-        return score
-
-
-    def update_candidate_names_with_score(self):
-        names_with_scores = []
-        for spc in self.spelling_pair_controllers:
-            names = spc.get_candidate_names()
-            if not names:
-                continue
-
-            for w1, w2 in names:
-                if (w1, w2) in self.refused_names or (w1, w2) in self.selected_names:
-                    continue
-                score = self.score_name(w1, w2)
-                names_with_scores.append((w1, w2, score))
-
-        self.candidate_names_with_score = sorted(names_with_scores, key=lambda tup: tup[2])
-        #print(self.candidate_names_with_score)
-        self.num_candidates_label.config(text=len(self.candidate_names_with_score))
-        self.update_current_candidate_name()
-
-
-    def update_current_candidate_name(self):
-        if self.candidate_names_with_score:
-            (w1, w2, score) = self.candidate_names_with_score.pop()
-            self.candidate_name = (w1, w2)
-            name = w1 + w2
-            self.candidate_label.config(text=name)
-            self.select_button.config(state=tkinter.NORMAL)
-            self.refuse_button.config(state=tkinter.ACTIVE)
-        else:
-            self.candidate_name = None
-            self.candidate_label.config(text='')
-            self.select_button.config(state=tkinter.DISABLED)
-            self.refuse_button.config(state=tkinter.DISABLED)
 
+    def cache_key(self):
+        # the files load_state() and load_ranker_files() read
+        file_names = [self.SPELLINGS_FILE_NAME, self.SELECTED_WORDS_FILE_NAME, self.STATE_FILE_NAME, self.CONSTRAINTS_FILE_NAME, self.SELECTED_NAMES_FILE_NAME, self.REFUSED_NAMES_FILE_NAME, self.VOTE_JOURNAL_FILE_NAME]
+        return rankcache.fingerprint(file_names, 'picknames2')
 
-    def select_current_candidate_name(self):
-        (w1, w2) = self.candidate_name
-        self.add_selected_name(w1, w2)
-        self.update_selected_names_view()
-        #self.update_current_candidate_name()
-        self.update_candidate_names_with_score()
 
+    @profiling.timed_calls('picknames2.save_state')
+    def save_state(self):
+        selected_spelling_pairs = self.spelling_pair_grid.get_selected_spelling_pairs()
+        if self.store:
+            self.store.save_selected_spelling_pairs(selected_spelling_pairs)
+        else:
+            nameranker.save_selected_spelling_pairs(self.STATE_FILE_NAME, selected_spelling_pairs)
+            self.watcher.refresh([self.STATE_FILE_NAME])
 
-    def update_selected_names_view(self):
-        names = sorted([w1 + w2 for (w1, w2) in self.selected_names])
-        self.selected_slb.setlist(names)
+        self.worker.submit(self.save_ranker, update=False)
 
 
-    def refuse_current_candidate_name(self):
-        (w1, w2) = self.candidate_name
-        self.add_refused_name(w1, w2)
-        #names = [w1 + w2 for (w1, w2) in self.refused_names]
-        #self.refused_slb.setlist(names)
-        #self.update_current_candidate_name()
-        self.update_candidate_names_with_score()
+    def update_spelling_pair(self, spelling_pair_grid, i, j):
+        # only this pair's names join or leave the ranking
+        # the candidate shown is replaced once the worker catches up
+        pair = spelling_pair_grid.get_spelling_pair(i, j)
+        if spelling_pair_grid.is_selected(i, j):
+            self.worker.submit(self.ranker.add_word_pairs, (pair,) + spelling_pair_grid.get_words(i, j), update=False)
+        else:
+            self.worker.submit(self.ranker.remove_word_pairs, (pair,), update=False)
 
 
 class App(object):
-    def __init__(self, root):
+    def __init__(self, root, prefetch=nameranker.RankingWorker.PREFETCH, store=None, cache=None, watch=False):
         self.root = root
 
-        self.nsc = NameSelectController(root)
+        self.nsc = NameSelectController(root, prefetch, store, cache, watch)
 
         self.button = tkinter.Button(root, text='離開', fg="red", command=self.quit)
         self.button.pack(side=tkinter.RIGHT)
@@ -346,10 +368,12 @@ class App(object):
 
     def save_and_quit(self):
         self.nsc.save_state()
+        self.nsc.close_state()
         self.root.quit()
 
 
     def quit(self):
+        self.nsc.close_state()
         self.root.quit()
 
 
@@ -358,11 +382,33 @@ class App(object):
 
 
 def main():
+    parser = argparse.ArgumentParser(description='取名字')
+    parser.add_argument('--top-k', type=int, default=nameranker.RankingWorker.PREFETCH, help='number of candidates ranked ahead after each vote')
+    parser.add_argument('--db', help='keep the selected words, spelling pairs and votes in this state database')
+    parser.add_argument('--no-cache', action='store_true', help='always load the ranking from the files, never from ' + rankcache.CACHE_DIRECTORY)
+    parser.add_argument('--no-watch', action='store_true', help='only reload the files when asked to, not as soon as another program writes them')
+    profiling.add_arguments(parser)
+    parser.add_argument('--profile-vote', metavar='PROFILE_FILE', help='write a cProfile of the re-rank after the first vote to this file')
+    args = parser.parse_args()
+    profiling.enable_from_arguments(args)
+
+    store = None
+    if args.db:
+        store = statestore.StateStore(args.db)
+
     root = tkinter.Tk()
     root.option_readfile('.picknames2.tkinter.options')
     root.wm_title('取名字')
     Pmw.initialise()
-    app = App(root)
+    cache = None
+    if not args.no_cache:
+        cache = rankcache.RankingCache()
+
+    app = App(root, args.top_k, store, cache, not args.no_watch)
+    root.after_idle(profiling.mark_ready, root, 'first_frame')
+    app.nsc.profile_vote_file_name = args.profile_vote
+    if args.stats:
+        profiling.StatsPanel(root, profiling.profiler)
     root.mainloop()
 
 
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
-import csv
+import argparse
+import lexicon
 import os
 import pickle
 import Pmw
+import profiling
 import tkinter
+import tkinter.font
 
 class WordController(object):
 
+    __slots__ = ('word', 'button', 'selected')
+
     def __init__(self, parent_view, column, word):
         self.word = word
         self.button = tkinter.Button(parent_view, text=word, command=self.toggle_word_button)
@@ -37,6 +42,8 @@ class WordController(object):
 
 class SoundController(object):
 
+    __slots__ = ('sound', 'candidate_words', 'sound_label', 'words_frame', 'word_controllers')
+
     def __init__(self, parent_view, row, sound, words):
         self.sound = sound
         self.candidate_words = words
@@ -85,9 +92,125 @@ class SoundController(object):
         self.words_frame.destroy()
 
 
+class WordGrid(object):
+
+    # the sounds and words of one spelling drawn on a single canvas instead
+    # of a Label per sound and a Button per word; a row's items are only
+    # created once it scrolls into the viewport
+
+    __slots__ = ('viewport', 'rows', 'selected_words', 'row_items', 'canvas', 'word_font', 'sound_font', 'sound_width', 'cell_width', 'row_height', 'destroyed')
+
+    PADDING = 4
+
+
+    def __init__(self, parent_view, viewport, sound_words_pairs):
+        self.viewport = viewport
+        self.rows = [(sound, list(words)) for (sound, words) in sound_words_pairs]
+        self.selected_words = [set() for row in self.rows]
+        self.row_items = {}  # row: [(rectangle, text)], for the rows drawn so far
+
+        self.canvas = tkinter.Canvas(parent_view, highlightthickness=0)
+        self.canvas.grid(row=0, column=0, sticky=tkinter.NW)
+        self.canvas.bind('<Button-1>', self.click)
+
+        self.word_font = tkinter.font.Font(root=self.canvas, font=self.canvas.option_get('font', 'Font') or 'TkDefaultFont')
+        self.sound_font = self.word_font.copy()
+        self.sound_font.config(weight='bold')
+
+        self.sound_width = max([self.sound_font.measure(sound) for (sound, words) in self.rows] + [0]) + 2 * self.PADDING
+        self.cell_width = self.word_font.measure('字') + 2 * self.PADDING
+        self.row_height = max(self.word_font.metrics('linespace'), self.sound_font.metrics('linespace')) + 2 * self.PADDING
+        num_columns = max([len(words) for (sound, words) in self.rows] + [0])
+        self.canvas.config(width=self.sound_width + num_columns * self.cell_width, height=len(self.rows) * self.row_height)
+
+        # the canvas has no position until it is mapped
+        self.destroyed = False
+        self.canvas.after_idle(self.draw_visible_rows)
+
+
+    def draw_visible_rows(self):
+        if self.destroyed:
+            return
+
+        top = self.viewport.winfo_rooty() - self.canvas.winfo_rooty()
+        bottom = top + self.viewport.winfo_height()
+        first = max(0, top // self.row_height)
+        last = min(len(self.rows), bottom // self.row_height + 1)
+        for row in range(first, last):
+            if row not in self.row_items:
+                self.draw_row(row)
+
+
+    @profiling.timed_calls('pickwords.draw_row')
+    def draw_row(self, row):
+        (sound, words) = self.rows[row]
+        y = row * self.row_height
+        self.canvas.create_text(self.PADDING, y + self.row_height // 2, text=sound, font=self.sound_font, anchor=tkinter.W)
+
+        items = []
+        for column, word in enumerate(words):
+            x = self.sound_width + column * self.cell_width
+            rectangle = self.canvas.create_rectangle(x + 1, y + 1, x + self.cell_width - 1, y + self.row_height - 1)
+            text = self.canvas.create_text(x + self.cell_width // 2, y + self.row_height // 2, text=word, font=self.word_font)
+            items.append((rectangle, text))
+        self.row_items[row] = items
+
+        for column in range(len(words)):
+            self.draw_word(row, column)
+
+
+    def draw_word(self, row, column):
+        if row not in self.row_items:
+            return
+
+        (rectangle, text) = self.row_items[row][column]
+        if self.rows[row][1][column] in self.selected_words[row]:
+            self.canvas.itemconfig(rectangle, fill='gray70', outline='gray40')
+            self.canvas.itemconfig(text, fill='red')
+        else:
+            self.canvas.itemconfig(rectangle, fill='', outline='gray70')
+            self.canvas.itemconfig(text, fill='black')
+
+
+    def click(self, event):
+        row = event.y // self.row_height
+        column = (event.x - self.sound_width) // self.cell_width
+        if event.x < self.sound_width or not 0 <= row < len(self.rows) or column >= len(self.rows[row][1]):
+            return
+
+        word = self.rows[row][1][column]
+        self.selected_words[row] ^= {word}
+        self.draw_word(row, column)
+
+
+    def load_state(self, selected_sound_words_mapping):
+        for row, (sound, words) in enumerate(self.rows):
+            if sound in selected_sound_words_mapping and selected_sound_words_mapping[sound]:
+                self.selected_words[row] = set(words) & set(selected_sound_words_mapping[sound])
+                for column in range(len(words)):
+                    self.draw_word(row, column)
+
+
+    def get_selected_sounds_state(self):
+        selected_sound_words_mapping = {}
+        for row, (sound, words) in enumerate(self.rows):
+            selected_words = [word for word in words if word in self.selected_words[row]]
+            if selected_words:
+                selected_sound_words_mapping[sound] = selected_words
+
+        return selected_sound_words_mapping
+
+
+    def destroy(self):
+        self.destroyed = True
+        self.canvas.destroy()
+
+
 class SpellingController(object):
 
-    def __init__(self, parent_view, row, spelling, chewing, sound_words_pairs):
+    __slots__ = ('spelling', 'chewing', 'sound_words_pairs', 'selected', 'spelling_button', 'sounds_frame', 'viewport', 'word_grid', 'sound_controllers')
+
+    def __init__(self, parent_view, row, spelling, chewing, sound_words_pairs, viewport=None):
         self.spelling = spelling
         self.chewing = chewing
         self.sound_words_pairs = sound_words_pairs
@@ -99,6 +222,9 @@ class SpellingController(object):
         self.sounds_frame = tkinter.Frame(parent_view)
         self.sounds_frame.grid(row=row, column=1, sticky=tkinter.NW)
 
+        # words are drawn on a WordGrid scrolled in viewport, or as buttons without one
+        self.viewport = viewport
+        self.word_grid = None
         self.sound_controllers = []
 
 
@@ -108,6 +234,10 @@ class SpellingController(object):
 
         self.toggle_spelling_button()
 
+        if self.word_grid:
+            self.word_grid.load_state(selected_sound_words_mapping)
+            return
+
         for sc in self.sound_controllers:
             if sc.sound in selected_sound_words_mapping:
                 selected_words = selected_sound_words_mapping[sc.sound]
@@ -118,6 +248,9 @@ class SpellingController(object):
         if not self.selected:
             return None
 
+        if self.word_grid:
+            return self.word_grid.get_selected_sounds_state()
+
         selected_sound_words_mapping = {}
         for sc in self.sound_controllers:
             selected_words = sc.get_selected_words()
@@ -140,7 +273,12 @@ class SpellingController(object):
         self.selected = not self.selected
 
 
+    @profiling.timed_calls('pickwords.select_spelling')
     def select_spelling(self):
+        if self.viewport:
+            self.word_grid = WordGrid(self.sounds_frame, self.viewport, self.sound_words_pairs)
+            return
+
         for i, (sound, words) in enumerate(self.sound_words_pairs):
             try:
                 sc = SoundController(self.sounds_frame, i, sound, words)
@@ -149,7 +287,12 @@ class SpellingController(object):
                 print(e)
 
 
+    @profiling.timed_calls('pickwords.deselect_spelling')
     def deselect_spelling(self):
+        if self.word_grid:
+            self.word_grid.destroy()
+            self.word_grid = None
+
         for sc in self.sound_controllers:
             sc.destroy()
         self.sound_controllers = []
@@ -157,19 +300,34 @@ class SpellingController(object):
 
 class WordSelectController(object):
 
-    DATA_FILE_NAME = '.pickwords.data.pkl'
+    DATA_FILE_NAME = lexicon.DATA_FILE_NAME
+    LEXICON_FILE_NAME = lexicon.LEXICON_FILE_NAME
     STATE_FILE_NAME = 'words-selected.pkl'
 
+    # spellings built before the window first shows, the rest are built
+    # HYDRATE_ROWS at a time between events
+    FIRST_ROWS = 60
+    HYDRATE_ROWS = 200
 
-    def __init__(self, parent_view):
+
+    def __init__(self, parent_view, virtualized=True, store=None):
+        self.store = store  # a statestore.StateStore instead of STATE_FILE_NAME
         self.sf = Pmw.ScrolledFrame(parent_view, labelpos=tkinter.N, label_text='音 & 字')
         self.sf.pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=True)
 
+        # scrolling moves the interior inside the clipper, resizing the window resizes the clipper
+        viewport = None
+        if virtualized:
+            viewport = self.sf.component('clipper')
+            viewport.bind('<Configure>', self.draw_visible_words, add='+')
+            self.sf.interior().bind('<Configure>', self.draw_visible_words, add='+')
+
         self.spelling_controllers = []
+        self.saved_state = {}
 
-        data = None
-        with open(self.DATA_FILE_NAME, 'rb') as f:
-            data = pickle.load(f)
+        # the compiled lexicon decodes a spelling's sounds only when it is expanded
+        with profiling.profiler.timed('pickwords.load_lexicon'):
+            data = lexicon.load_lexicon(self.LEXICON_FILE_NAME, self.DATA_FILE_NAME)
 
         # [
         #   ("Pan", "ㄅㄢ", [
@@ -182,25 +340,53 @@ class WordSelectController(object):
         #   ...
         # ]
 
-        for i, (spelling, chewing, sound_words_pairs) in enumerate(data):
-            spc = SpellingController(self.sf.interior(), i, spelling, chewing, sound_words_pairs)
-            self.spelling_controllers.append(spc)
+        self.data = data
+        self.viewport = viewport
         self.load_state()
+        self.build_rows(self.FIRST_ROWS)
+        if len(self.spelling_controllers) < len(self.data):
+            self.sf.after_idle(self.hydrate)
+
+
+    @profiling.timed_calls('pickwords.build')
+    def build_rows(self, num_rows):
+        # the next num_rows spellings, with their saved state
+        for i in range(len(self.spelling_controllers), min(len(self.data), len(self.spelling_controllers) + num_rows)):
+            (spelling, chewing, sound_words_pairs) = self.data[i]
+            spc = SpellingController(self.sf.interior(), i, spelling, chewing, sound_words_pairs, self.viewport)
+            self.spelling_controllers.append(spc)
+            if spelling in self.saved_state:
+                spc.load_state(self.saved_state[spelling])
+
+
+    def hydrate(self):
+        self.build_rows(self.HYDRATE_ROWS)
+        if len(self.spelling_controllers) < len(self.data):
+            self.sf.after(1, self.hydrate)
+        else:
+            profiling.mark_ready(self.sf, 'hydrated')
+
+
+    def draw_visible_words(self, event=None):
+        for spc in self.spelling_controllers:
+            if spc.word_grid:
+                spc.word_grid.draw_visible_rows()
 
 
+    @profiling.timed_calls('pickwords.load_state')
     def load_state(self):
+        # applied by build_rows() as the spellings are built
         saved_state = {}
-        if os.path.exists(self.STATE_FILE_NAME):
+        if self.store:
+            saved_state = self.store.load_selected_words()
+        elif os.path.exists(self.STATE_FILE_NAME):
             with open(self.STATE_FILE_NAME, 'rb') as f:
                 saved_state = pickle.load(f)
         #print('LOAD:', saved_state)
-
-        for spc in self.spelling_controllers:
-            if spc.spelling in saved_state:
-                selected_sound_words_mapping = saved_state[spc.spelling]
-                spc.load_state(selected_sound_words_mapping)
+        self.saved_state = saved_state
 
 
+    @profiling.timed_calls('pickwords.save_state')
     def save_state(self):
         state = {}
         for spc in self.spelling_controllers:
@@ -210,17 +396,32 @@ class WordSelectController(object):
 
             state[spc.spelling] = selected_sounds_state
 
+        # spellings not built yet keep what was loaded
+        for i in range(len(self.spelling_controllers), len(self.data)):
+            (spelling, chewing, sound_words_pairs) = self.data[i]
+            if spelling in self.saved_state:
+                state[spelling] = self.saved_state[spelling]
+
         #print('SAVE:', state)
-        with open(self.STATE_FILE_NAME, 'wb') as f:
+        if self.store:
+            self.store.save_selected_words(state)
+            return
+
+        # swapped in whole, the pickers may be reading it
+        temp_file_name = self.STATE_FILE_NAME + '.tmp'
+        with open(temp_file_name, 'wb') as f:
             pickle.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file_name, self.STATE_FILE_NAME)
 
 
 class App(object):
 
-    def __init__(self, root):
+    def __init__(self, root, virtualized=True, store=None):
         self.root = root
 
-        self.wsc = WordSelectController(root)
+        self.wsc = WordSelectController(root, virtualized, store)
 
         self.button = tkinter.Button(root, text='離開', fg="red", command=self.quit)
         self.button.pack(side=tkinter.RIGHT)
@@ -246,11 +447,27 @@ class App(object):
 
 
 def main():
+    parser = argparse.ArgumentParser(description='選字')
+    parser.add_argument('--widgets', action='store_true', help='one button per word instead of a canvas per spelling')
+    parser.add_argument('--db', help='keep the selected words in this state database')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.enable_from_arguments(args)
+
+    store = None
+    if args.db:
+        # sqlite3 is only imported for --db
+        import statestore
+        store = statestore.StateStore(args.db)
+
     root = tkinter.Tk()
     root.option_readfile('.pickwords.tkinter.options')
     root.wm_title('選字')
     Pmw.initialise()
-    app = App(root)
+    app = App(root, not args.widgets, store)
+    root.after_idle(profiling.mark_ready, root, 'first_frame')
+    if args.stats:
+        profiling.StatsPanel(root, profiling.profiler)
     root.mainloop()
 
 
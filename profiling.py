@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import argparse
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+
+# Opt-in timings and counts for the parts of a session that can be slow:
+# loading, scoring, ranking, widgets and saving.  Set PICKNAMES_PROFILE to
+# a file name, or pass --profile to a tool, and every timed() span is
+# written there at exit as a Chrome trace (chrome://tracing or
+# https://ui.perfetto.dev), with the count, total and longest time of each
+# name under "stats".  Otherwise timed() and count() do next to nothing.
+#
+#   @profiling.timed_calls('ranker.update')
+#   def update(self):
+#       ...
+#
+#   with profiling.profiler.timed('pickwords.build'):
+#       ...
+#   profiling.profiler.count('ranker.votes')
+#
+# profile_next() runs the next batch of RankingWorker, such as the re-rank
+# after a vote, under cProfile; `profiling.py vote.prof` prints the result.
+
+PROFILE_ENV = 'PICKNAMES_PROFILE'
+READY_ENV = 'PICKNAMES_READY'
+
+MAX_EVENTS = 100000 # spans kept for the trace, the stats keep counting
+
+
+class NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_span(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Profiler(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_file_name = None
+        # spans come from RankingWorker's thread too
+        self.lock = threading.Lock()
+        self.epoch = time.perf_counter()
+        self.events = []    # Chrome trace events
+        self.stats = {}     # name: [count, total seconds, longest seconds]
+        self.next_profile_file_name = None
+
+
+    def enable(self, trace_file_name=None):
+        # without a file name the stats are only kept for StatsPanel
+        if not self.enabled:
+            atexit.register(self.save)
+        self.enabled = True
+        self.trace_file_name = trace_file_name or self.trace_file_name
+
+
+    def timed(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            stat = self.stats.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += n
+
+
+    def add_span(self, name, start, end):
+        with self.lock:
+            stat = self.stats.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += end - start
+            stat[2] = max(stat[2], end - start)
+            if len(self.events) < MAX_EVENTS:
+                self.events.append({
+                    'name': name,
+                    'ph': 'X',
+                    'ts': (start - self.epoch) * 1e6,
+                    'dur': (end - start) * 1e6,
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                })
+
+
+    def profile_next(self, file_name):
+        # cProfile the next profiled() block, whatever the thread
+        self.next_profile_file_name = file_name
+
+
+    def profiled(self):
+        file_name = self.next_profile_file_name
+        if not file_name:
+            return NULL_SPAN
+        self.next_profile_file_name = None
+        return ProfiledSpan(file_name)
+
+
+    def summary(self):
+        # [(name, count, total seconds, longest seconds)], longest total first
+        with self.lock:
+            rows = [(name,) + tuple(stat) for name, stat in self.stats.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+
+    def save(self):
+        if not self.trace_file_name:
+            return
+
+        with self.lock:
+            trace = {
+                'traceEvents': list(self.events),
+                'stats': {name: {'count': count, 'total': total, 'max': longest} for name, (count, total, longest) in self.stats.items()},
+            }
+        with open(self.trace_file_name, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False)
+
+
+class ProfiledSpan(object):
+
+    def __init__(self, file_name):
+        import cProfile
+
+        self.file_name = file_name
+        self.profile = cProfile.Profile()
+
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self.profile.dump_stats(self.file_name)
+        return False
+
+
+class StatsPanel(object):
+
+    # A small window with the profiler's summary, refreshed every second
+
+    REFRESH_INTERVAL = 1000 # ms
+
+    def __init__(self, parent_view, profiler):
+        import tkinter
+
+        self.profiler = profiler
+        self.window = tkinter.Toplevel(parent_view)
+        self.window.wm_title('效能')
+        self.label = tkinter.Label(self.window, justify=tkinter.LEFT, font='TkFixedFont')
+        self.label.pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=True)
+        self.refresh()
+
+
+    def refresh(self):
+        lines = ['%-40s %8s %10s %10s' % ('', 'count', 'total ms', 'max ms')]
+        for (name, count, total, longest) in self.profiler.summary():
+            lines.append('%-40s %8d %10.1f %10.1f' % (name, count, total * 1000, longest * 1000))
+        self.label.config(text='\n'.join(lines))
+        self.window.after(self.REFRESH_INTERVAL, self.refresh)
+
+
+def timed_calls(name):
+    # decorates a function so that each call is a span
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.timed(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def mark_ready(widget, name):
+    # how long the window took to get this far, as a span from the import
+    # of this module; benchmark.py sets PICKNAMES_READY to the mark it
+    # waits for, reads the marks from stdout and has the window quit there
+    if profiler.enabled:
+        profiler.add_span('ready.' + name, profiler.epoch, time.perf_counter())
+
+    stop_at = os.environ.get(READY_ENV)
+    if stop_at:
+        print('ready', name, flush=True)
+        if name == stop_at:
+            widget.quit()
+
+
+def add_arguments(parser):
+    # --profile and --stats for the tools with a window
+    parser.add_argument('--profile', metavar='TRACE_FILE', help='write timings of loading, ranking, widgets and saving to this JSON trace file')
+    parser.add_argument('--stats', action='store_true', help='show the timings in a window of their own')
+
+
+def enable_from_arguments(args):
+    if args.profile or args.stats:
+        profiler.enable(args.profile)
+
+
+profiler = Profiler()
+if os.environ.get(PROFILE_ENV):
+    profiler.enable(os.environ[PROFILE_ENV])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a cProfile file written by --profile-vote.')
+    parser.add_argument('profile_file')
+    parser.add_argument('--sort', default='cumulative')
+    parser.add_argument('--limit', type=int, default=30)
+    args = parser.parse_args()
+
+    import pstats
+
+    pstats.Stats(args.profile_file).sort_stats(args.sort).print_stats(args.limit)
+
+
+if __name__ == "__main__":
+    main()
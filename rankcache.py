@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import pickle
+
+
+# The state NameRanker builds when picknames.py or picknames2.py loads the
+# selected words and the votes (the interned words, the name blocks, the
+# voted and excluded names and the vote counts), pickled in CACHE_DIRECTORY
+# under a hash of the files it was built from.  Opening or reloading a
+# session whose files have not changed since it was last loaded or saved
+# only unpickles it.  The least recently used entries are deleted once the
+# directory holds more than MAX_CACHE_BYTES.
+#
+#   cache = rankcache.RankingCache()
+#   key = rankcache.fingerprint(file_names, 'picknames', name_lengths)
+#   state = cache.load(key)
+#   if state:
+#       ranker.set_loaded_state(state)
+#   else:
+#       ...
+#       cache.save(key, ranker.get_loaded_state())
+
+CACHE_DIRECTORY = '.picknames-cache'
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# part of every key, bump it when the state NameRanker caches changes
+CACHE_VERSION = 3
+
+
+def fingerprint(file_names, *parameters):
+    # a hash of the contents of file_names, missing ones included, and of parameters
+    h = hashlib.sha256()
+    h.update(repr((CACHE_VERSION, parameters)).encode('utf-8'))
+    for file_name in file_names:
+        h.update(b'\0' + file_name.encode('utf-8') + b'\0')
+        if not os.path.exists(file_name):
+            h.update(b'-')
+            continue
+        h.update(b'+')
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class RankingCache(object):
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+
+    def file_name(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+
+    def load(self, key):
+        # the state saved under key, or None
+        file_name = self.file_name(key)
+        if not os.path.exists(file_name):
+            return None
+
+        try:
+            with open(file_name, 'rb') as f:
+                state = pickle.load(f)
+            # most recently used
+            os.utime(file_name)
+        except Exception:
+            # cut short or written by another version, never worth failing over
+            self.discard(key)
+            return None
+        return state
+
+
+    def save(self, key, state):
+        # write a new file and swap it in, like nameranker.save_names()
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = self.file_name(key)
+        temp_file_name = '%s.%d.tmp' % (file_name, os.getpid())
+        with open(temp_file_name, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file_name, file_name)
+        self.evict()
+
+
+    def discard(self, key):
+        try:
+            os.remove(self.file_name(key))
+        except OSError:
+            pass
+
+
+    def entries(self):
+        # [(last used, size, file name)], least recently used first
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        return entries
+
+
+    def evict(self):
+        # down to max_bytes, always keeping the latest entry
+        entries = self.entries()
+        total = sum(size for (mtime, size, file_name) in entries)
+        for (mtime, size, file_name) in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file_name)
+            except OSError:
+                continue
+            total -= size
+
+
+    def clear(self):
+        for (mtime, size, file_name) in self.entries():
+            os.remove(file_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show or clear the cached rankings.')
+    parser.add_argument('--clear', action='store_true', help='delete every cached ranking')
+    parser.add_argument('--directory', default=CACHE_DIRECTORY)
+    args = parser.parse_args()
+
+    cache = RankingCache(args.directory)
+    if args.clear:
+        cache.clear()
+        return
+
+    entries = cache.entries()
+    for (mtime, size, file_name) in entries:
+        print('%10d  %s' % (size, os.path.basename(file_name)))
+    print('%d entries, %d bytes' % (len(entries), sum(size for (mtime, size, file_name) in entries)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import argparse
+import sqlite3
+
+import nameranker
+
+
+# One SQLite database in place of words-selected.pkl, .picknames2.state.pkl,
+# names-selected.txt and names-refused.txt:
+#
+#   selected_words  (spelling, sound, position, word), position orders the
+#                   words of a sound like the lexicon does
+#   votes           (name, selected), selected is 1 for ✔ and 0 for ✖
+#   spelling_pairs  (spelling1, spelling2), the pairs picked in picknames2.py
+#
+# The database is in WAL mode, so pickwords.py, picknames.py and
+# picknames2.py can have it open at the same time.  Votes are written as
+# they are cast and deleted when taken back, selections are saved as the
+# rows that changed.
+
+STATE_DATABASE_FILE_NAME = 'names.db'
+
+SCHEMA_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS selected_words (
+    spelling TEXT NOT NULL,
+    sound TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    word TEXT NOT NULL,
+    PRIMARY KEY (spelling, sound, word)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS votes (
+    name TEXT NOT NULL,
+    selected INTEGER NOT NULL,
+    PRIMARY KEY (name, selected)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS spelling_pairs (
+    spelling1 TEXT NOT NULL,
+    spelling2 TEXT NOT NULL,
+    PRIMARY KEY (spelling1, spelling2)
+) WITHOUT ROWID;
+'''
+
+
+# version 1 kept the votes as (w1, w2, selected), names of two words only
+UPGRADE_VOTES_1 = '''
+BEGIN;
+ALTER TABLE votes RENAME TO votes_1;
+CREATE TABLE votes (
+    name TEXT NOT NULL,
+    selected INTEGER NOT NULL,
+    PRIMARY KEY (name, selected)
+) WITHOUT ROWID;
+INSERT INTO votes (name, selected) SELECT w1 || w2, selected FROM votes_1;
+DROP TABLE votes_1;
+PRAGMA user_version = 2;
+COMMIT;
+'''
+
+
+class StateStoreError(Exception):
+    pass
+
+
+class StateStore(object):
+
+    def __init__(self, file_name=STATE_DATABASE_FILE_NAME, timeout=10.0):
+        self.file_name = file_name
+        # votes are recorded from nameranker.RankingWorker's thread
+        self.connection = sqlite3.connect(file_name, timeout=timeout, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise StateStoreError('%s: version %d, expected %d' % (file_name, version, SCHEMA_VERSION))
+        with self.connection:
+            if version == 1:
+                self.connection.executescript(UPGRADE_VOTES_1)
+            self.connection.executescript(SCHEMA)
+            self.connection.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+
+    def load_selected_words(self):
+        # {spelling: {sound: [words]}}, like words-selected.pkl
+        selected_spelling_sound_words_mapping = {}
+        for (spelling, sound, word) in self.connection.execute('SELECT spelling, sound, word FROM selected_words ORDER BY spelling, sound, position'):
+            selected_spelling_sound_words_mapping.setdefault(spelling, {}).setdefault(sound, []).append(word)
+        return selected_spelling_sound_words_mapping
+
+
+    def save_selected_words(self, selected_spelling_sound_words_mapping):
+        rows = {}
+        for spelling, selected_sound_words_mapping in selected_spelling_sound_words_mapping.items():
+            for sound, words in selected_sound_words_mapping.items():
+                for position, word in enumerate(words):
+                    rows[(spelling, sound, word)] = position
+
+        saved_rows = {}
+        for (spelling, sound, position, word) in self.connection.execute('SELECT spelling, sound, position, word FROM selected_words'):
+            saved_rows[(spelling, sound, word)] = position
+
+        with self.connection:
+            self.connection.executemany('DELETE FROM selected_words WHERE spelling = ? AND sound = ? AND word = ?',
+                                        [row for row in saved_rows if row not in rows])
+            self.connection.executemany('INSERT OR REPLACE INTO selected_words (spelling, sound, position, word) VALUES (?, ?, ?, ?)',
+                                        [(spelling, sound, position, word) for ((spelling, sound, word), position) in rows.items() if saved_rows.get((spelling, sound, word)) != position])
+
+
+    def load_votes(self):
+        # yields (name, selected)
+        for (name, selected) in self.connection.execute('SELECT name, selected FROM votes ORDER BY selected DESC'):
+            yield (tuple(name), bool(selected))
+
+
+    def record_vote(self, name, selected):
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO votes (name, selected) VALUES (?, ?)', (''.join(name), int(selected)))
+
+
+    def retract_vote(self, name, selected):
+        with self.connection:
+            self.connection.execute('DELETE FROM votes WHERE name = ? AND selected = ?', (''.join(name), int(selected)))
+
+
+    def save_votes(self, selected_names, refused_names):
+        # adds names not recorded yet, retract_vote() takes them back
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO votes (name, selected) VALUES (?, 1)', [(''.join(name),) for name in selected_names])
+            self.connection.executemany('INSERT OR IGNORE INTO votes (name, selected) VALUES (?, 0)', [(''.join(name),) for name in refused_names])
+
+
+    def load_selected_spelling_pairs(self):
+        return self.connection.execute('SELECT spelling1, spelling2 FROM spelling_pairs').fetchall()
+
+
+    def save_selected_spelling_pairs(self, selected_spelling_pairs):
+        selected_spelling_pairs = set(selected_spelling_pairs)
+        saved_spelling_pairs = set(self.load_selected_spelling_pairs())
+
+        with self.connection:
+            self.connection.executemany('DELETE FROM spelling_pairs WHERE spelling1 = ? AND spelling2 = ?',
+                                        saved_spelling_pairs - selected_spelling_pairs)
+            self.connection.executemany('INSERT INTO spelling_pairs (spelling1, spelling2) VALUES (?, ?)',
+                                        selected_spelling_pairs - saved_spelling_pairs)
+
+
+    def close(self):
+        self.connection.close()
+
+
+def migrate(store,
+            selected_words_file_name=nameranker.SELECTED_WORDS_FILE_NAME,
+            selected_spelling_pairs_file_name=nameranker.SELECTED_SPELLING_PAIRS_FILE_NAME,
+            selected_names_file_name=nameranker.SELECTED_NAMES_FILE_NAME,
+            refused_names_file_name=nameranker.REFUSED_NAMES_FILE_NAME,
+            journal_file_name=nameranker.VOTE_JOURNAL_FILE_NAME):
+    # copies the loose files into store, votes journaled since the last save included
+    store.save_selected_words(nameranker.load_selected_words(selected_words_file_name))
+    store.save_selected_spelling_pairs(nameranker.load_selected_spelling_pairs(selected_spelling_pairs_file_name))
+
+    selected_names = set(nameranker.load_names(selected_names_file_name))
+    refused_names = set(nameranker.load_names(refused_names_file_name))
+    journal = nameranker.VoteJournal(journal_file_name)
+    for (name, selected, taken_back) in journal.replay():
+        names = selected_names if selected else refused_names
+        if taken_back:
+            names.discard(name)
+        else:
+            names.add(name)
+    journal.close()
+    store.save_votes(selected_names, refused_names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy the selected words, spelling pairs and votes into a state database.')
+    parser.add_argument('database_file', nargs='?', default=STATE_DATABASE_FILE_NAME)
+    args = parser.parse_args()
+
+    store = StateStore(args.database_file)
+    migrate(store)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()